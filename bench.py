@@ -0,0 +1,134 @@
+"""Замеры производительности модуля фитнес-трекера.
+
+Пример запуска:
+
+    python bench.py --size 100000 --output bench.json
+    python bench.py --size 100000 --baseline bench.json
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+from itertools import islice
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+
+import homework
+
+CHUNK_SIZE = 100000
+SIZES = (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7)
+
+
+def generate_packages(size: int, seed: int = 0) -> Iterator[homework.Package]:
+    """Сгенерировать смесь пакетов SWM/RUN/WLK."""
+    rnd = random.Random(seed)
+    for _ in range(size):
+        workout_type = rnd.choice(('SWM', 'RUN', 'WLK'))
+        duration = rnd.randint(1, 180) / 60
+        weight = rnd.randint(45, 120)
+        if workout_type == 'SWM':
+            yield workout_type, [rnd.randint(100, 3000), duration, weight,
+                                 rnd.choice((25, 50)), rnd.randint(1, 80)]
+        elif workout_type == 'RUN':
+            yield workout_type, [rnd.randint(1000, 30000), duration, weight]
+        else:
+            yield workout_type, [rnd.randint(1000, 20000), duration, weight,
+                                 rnd.randint(150, 200)]
+
+
+def _timed(function: Callable[[], object]) -> float:
+    """Вернуть время выполнения функции в секундах."""
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def _bench_chunk(packages: List[homework.Package],
+                 timings: Dict[str, float]) -> None:
+    """Замерить этапы обработки для одной части пакетов."""
+    read_package = homework.read_package
+
+    def build() -> List[homework.Training]:
+        return [read_package(workout_type, data)
+                for workout_type, data in packages]
+
+    timings['read_package'] += _timed(build)
+    by_class: Dict[type, List[homework.Training]] = {}
+    for training in build():
+        by_class.setdefault(type(training), []).append(training)
+    for training_class, trainings in by_class.items():
+        name = f'{training_class.__name__}.get_spent_calories'
+        timings[name] = timings.get(name, 0.0) + _timed(
+            lambda: [training.get_spent_calories() for training in trainings])
+    trainings = build()
+    infos: List[homework.InfoMessage] = []
+    timings['show_training_info'] += _timed(
+        lambda: infos.extend(training.show_training_info()
+                             for training in trainings))
+    timings['get_message'] += _timed(
+        lambda: [info.get_message() for info in infos])
+    workout_types = [workout_type for workout_type, _ in packages]
+    columns = [[data[j] if j < len(data) else 0 for _, data in packages]
+               for j in range(5)]
+    timings['compute_batch'] += _timed(
+        lambda: homework.compute_batch(workout_types, columns))
+
+
+def run(size: int, seed: int = 0) -> Dict[str, object]:
+    """Выполнить замеры и вернуть время на один пакет в наносекундах."""
+    timings = dict.fromkeys(('read_package', 'show_training_info',
+                             'get_message', 'compute_batch'), 0.0)
+    packages = generate_packages(size, seed)
+    while True:
+        chunk = list(islice(packages, CHUNK_SIZE))
+        if not chunk:
+            break
+        _bench_chunk(chunk, timings)
+    return {
+        'size': size,
+        'python': platform.python_version(),
+        'ns_per_packet': {name: seconds * 1e9 / size
+                          for name, seconds in sorted(timings.items())},
+    }
+
+
+def compare(result: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Вернуть описания замеров, замедлившихся больше допустимого."""
+    regressions = []
+    for name, value in result['ns_per_packet'].items():
+        previous = baseline['ns_per_packet'].get(name)
+        if previous and value > previous * (1 + tolerance):
+            regressions.append(f'{name}: {previous:.1f} -> {value:.1f} нс')
+    return regressions
+
+
+def cli(argv: Optional[Sequence[str]] = None) -> int:
+    """Запустить замеры и сравнить их с сохранённым результатом."""
+    parser = argparse.ArgumentParser(description=cli.__doc__)
+    parser.add_argument('--size', type=int, default=SIZES[2],
+                        help='число пакетов, например ' + ', '.join(
+                            str(size) for size in SIZES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='сохранить результат в JSON')
+    parser.add_argument('--baseline', help='JSON с предыдущим результатом')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='допустимое замедление, доля')
+    args = parser.parse_args(argv)
+    result = run(args.size, args.seed)
+    for name, value in result['ns_per_packet'].items():
+        print(f'{name:40} {value:10.1f} нс/пакет')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(result, file, indent=2, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            regressions = compare(result, json.load(file), args.tolerance)
+        for regression in regressions:
+            print('Замедление', regression, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(cli())
@@ -1,10 +1,65 @@
-from dataclasses import dataclass, asdict
-from typing import Dict, Type
+from __future__ import annotations
+
+import atexit
+import heapq
+import importlib
+import json
+import math
+import mmap
+import numbers
+import os
+import struct
+import sys
+import time
+from collections import Counter, OrderedDict, deque
+from dataclasses import dataclass
+from functools import lru_cache, wraps
+from itertools import islice
+from typing import (BinaryIO, Callable, Dict, FrozenSet, Iterable, Iterator,
+                    List, Optional, Sequence, TextIO, Tuple, Type, TypeVar,
+                    Union)
+
+
+class _LazyModule:
+    """Заместитель модуля, который импортируется при первом обращении.
+
+    После импорта заместитель заменяется в пространстве имён модулем,
+    поэтому дальнейшие обращения не проходят через `__getattr__`.
+    """
+
+    def __init__(self, name: str, alias: str) -> None:
+        self._name = name
+        self._alias = alias
+
+    def __getattr__(self, attribute: str) -> object:
+        module = importlib.import_module(self._name)
+        globals()[self._alias] = module
+        return getattr(module, attribute)
+
+
+argparse = _LazyModule('argparse', 'argparse')
+asyncio = _LazyModule('asyncio', 'asyncio')
+cProfile = _LazyModule('cProfile', 'cProfile')
+futures = _LazyModule('concurrent.futures', 'futures')
+hashlib = _LazyModule('hashlib', 'hashlib')
+np = _LazyModule('numpy', 'np')
+sqlite3 = _LazyModule('sqlite3', 'sqlite3')
+
+STARTUP_BUDGET_SECONDS = 0.5
+
+MESSAGE_TEMPLATE = ('Тип тренировки: {}; '
+                    'Длительность: {:.3f} ч.; '
+                    'Дистанция: {:.3f} км; '
+                    'Ср. скорость: {:.3f} км/ч; '
+                    'Потрачено ккал: {:.3f}.')
+_format_message = MESSAGE_TEMPLATE.format
 
 
 @dataclass
 class InfoMessage:
     """Информационное сообщение о тренировке."""
+    __slots__ = ('training_type', 'duration', 'distance', 'speed', 'calories')
+
     training_type: str
     duration: float
     distance: float
@@ -13,12 +68,225 @@ class InfoMessage:
 
     def get_message(self) -> str:
         """Функция возвращающая строку со значениями."""
-        message = ('Тип тренировки: {training_type}; '
-                   'Длительность: {duration:.3f} ч.; '
-                   'Дистанция: {distance:.3f} км; '
-                   'Ср. скорость: {speed:.3f} км/ч; '
-                   'Потрачено ккал: {calories:.3f}.'.format(**asdict(self)))
-        return message
+        return _format_message(self.training_type, self.duration,
+                               self.distance, self.speed, self.calories)
+
+
+class InfoMessageBatch:
+    """Колоночный набор информационных сообщений.
+
+    Тип тренировки хранится однобайтовым кодом, числовые поля - массивами
+    float64; объекты `InfoMessage` создаются только по запросу.
+    """
+    __slots__ = ('training_types', 'type_codes', 'duration', 'distance',
+                 'speed', 'calories')
+
+    def __init__(self,
+                 training_type: Sequence[str],
+                 duration: Sequence[float],
+                 distance: Sequence[float],
+                 speed: Sequence[float],
+                 calories: Sequence[float],
+                 ) -> None:
+        names, codes = np.unique(np.asarray(training_type, dtype=object),
+                                 return_inverse=True)
+        self.training_types: List[str] = names.tolist()
+        self.type_codes = codes.astype(np.uint8)
+        self.duration = np.asarray(duration, dtype=np.float64)
+        self.distance = np.asarray(distance, dtype=np.float64)
+        self.speed = np.asarray(speed, dtype=np.float64)
+        self.calories = np.asarray(calories, dtype=np.float64)
+
+    @classmethod
+    def from_codes(cls,
+                   training_types: List[str],
+                   type_codes: np.ndarray,
+                   duration: np.ndarray,
+                   distance: np.ndarray,
+                   speed: np.ndarray,
+                   calories: np.ndarray,
+                   ) -> 'InfoMessageBatch':
+        """Собрать набор из уже закодированных колонок без копирования."""
+        batch = cls.__new__(cls)
+        batch.training_types = training_types
+        batch.type_codes = type_codes
+        batch.duration = duration
+        batch.distance = distance
+        batch.speed = speed
+        batch.calories = calories
+        return batch
+
+    @classmethod
+    def from_messages(cls, messages: Iterable[InfoMessage]
+                      ) -> 'InfoMessageBatch':
+        """Собрать набор из последовательности сообщений."""
+        rows = [(info.training_type, info.duration, info.distance,
+                 info.speed, info.calories) for info in messages]
+        if not rows:
+            return cls([], [], [], [], [])
+        return cls(*zip(*rows))
+
+    def __len__(self) -> int:
+        return len(self.type_codes)
+
+    def __getitem__(self, index: int) -> InfoMessage:
+        return InfoMessage(self.training_types[self.type_codes[index]],
+                           self.duration[index].item(),
+                           self.distance[index].item(),
+                           self.speed[index].item(),
+                           self.calories[index].item())
+
+    def __iter__(self) -> Iterator[InfoMessage]:
+        types = self.training_types
+        for row in zip(self.type_codes.tolist(), self.duration.tolist(),
+                       self.distance.tolist(), self.speed.tolist(),
+                       self.calories.tolist()):
+            yield InfoMessage(types[row[0]], *row[1:])
+
+    def get_messages(self) -> Iterator[str]:
+        """Вернуть строки сообщений по одной."""
+        types = self.training_types
+        for row in zip(self.type_codes.tolist(), self.duration.tolist(),
+                       self.distance.tolist(), self.speed.tolist(),
+                       self.calories.tolist()):
+            yield _format_message(types[row[0]], *row[1:])
+
+
+def _encode_chunk(values: Sequence[int]) -> bytes:
+    """Закодировать отсчёты разностями в формате zigzag varint."""
+    encoded = bytearray()
+    previous = 0
+    for value in values:
+        delta = value - previous
+        previous = value
+        number = delta * 2 if delta >= 0 else -delta * 2 - 1
+        while number >= 0x80:
+            encoded.append(number & 0x7F | 0x80)
+            number >>= 7
+        encoded.append(number)
+    return bytes(encoded)
+
+
+def _decode_chunk(encoded: bytes) -> Iterator[int]:
+    """Раскодировать отсчёты, записанные `_encode_chunk`."""
+    previous = 0
+    number = shift = 0
+    for byte in encoded:
+        number |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        previous += number >> 1 if not number & 1 else -(number >> 1) - 1
+        yield previous
+        number = shift = 0
+
+
+class SampleSeries:
+    """Посекундные отсчёты датчика одной тренировки.
+
+    Отсчёты хранятся частями по `chunk_size`, каждая часть закодирована
+    разностями zigzag varint независимо от остальных, поэтому выборка
+    диапазона раскодирует только пересекающиеся с ним части.
+    """
+    MAGIC = b'FTRKSER1'
+
+    def __init__(self, chunk_size: int = 3600) -> None:
+        self.chunk_size = chunk_size
+        self.chunks: List[bytes] = []
+        self._tail: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.chunks) * self.chunk_size + len(self._tail)
+
+    def append(self, value: int) -> None:
+        """Добавить отсчёт."""
+        self._tail.append(value)
+        if len(self._tail) == self.chunk_size:
+            self.chunks.append(_encode_chunk(self._tail))
+            self._tail = []
+
+    def extend(self, values: Iterable[int]) -> None:
+        """Добавить последовательность отсчётов."""
+        for value in values:
+            self.append(value)
+
+    def _bounds(self, start: int, stop: Optional[int]) -> Tuple[int, int]:
+        """Ограничить диапазон длиной ряда."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        return max(start, 0), stop
+
+    def count(self, start: int = 0, stop: Optional[int] = None) -> int:
+        """Вернуть число отсчётов в диапазоне."""
+        start, stop = self._bounds(start, stop)
+        return max(stop - start, 0)
+
+    def iter_range(self, start: int = 0, stop: Optional[int] = None
+                   ) -> Iterator[int]:
+        """Лениво вернуть отсчёты с индексами из `[start, stop)`."""
+        start, stop = self._bounds(start, stop)
+        index = start - start % self.chunk_size
+        for chunk in self.chunks[start // self.chunk_size:]:
+            if index >= stop:
+                return
+            for value in _decode_chunk(chunk):
+                if index >= stop:
+                    return
+                if index >= start:
+                    yield value
+                index += 1
+        for value in self._tail[max(start - index, 0):stop - index]:
+            yield value
+
+    def total(self, start: int = 0, stop: Optional[int] = None) -> int:
+        """Вернуть сумму отсчётов в диапазоне."""
+        return sum(self.iter_range(start, stop))
+
+    def save(self, path: str) -> None:
+        """Сохранить ряд в файл."""
+        with open(path, 'wb') as file:
+            file.write(self.MAGIC)
+            file.write(struct.pack('<II', self.chunk_size, len(self._tail)))
+            for chunk in self.chunks + [_encode_chunk(self._tail)]:
+                file.write(struct.pack('<I', len(chunk)))
+                file.write(chunk)
+
+    @classmethod
+    def load(cls, path: str) -> 'SampleSeries':
+        """Загрузить ряд из файла."""
+        with open(path, 'rb') as file:
+            if file.read(len(cls.MAGIC)) != cls.MAGIC:
+                raise ValueError('Файл не является рядом отсчётов')
+            chunk_size, _ = struct.unpack('<II', file.read(8))
+            chunks = []
+            while True:
+                header = file.read(4)
+                if not header:
+                    break
+                chunks.append(file.read(struct.unpack('<I', header)[0]))
+        series = cls(chunk_size)
+        series.chunks = chunks[:-1]
+        series._tail = list(_decode_chunk(chunks[-1]))
+        return series
+
+
+PLUGIN_GROUP = 'fitness_tracker.trainings'
+TRAINING_TYPES: Dict[str, Type['Training']] = {}
+_plugins: Optional[Dict[str, object]] = None
+
+TrainingClass = TypeVar('TrainingClass', bound=Type['Training'])
+
+
+def register_training(workout_type_def: str
+                      ) -> Callable[[TrainingClass], TrainingClass]:
+    """Зарегистрировать класс тренировки под кодом пакета."""
+    def decorator(training_class: TrainingClass) -> TrainingClass:
+        registered = TRAINING_TYPES.setdefault(workout_type_def,
+                                               training_class)
+        if registered is not training_class:
+            raise ValueError(f'Код тренировки {workout_type_def} уже занят '
+                             f'классом {registered.__name__}')
+        return training_class
+    return decorator
 
 
 class Training:
@@ -27,6 +295,8 @@ class Training:
     LEN_SWIM: float = 1.38
     M_IN_KM: int = 1000
     HOURS_IN_MINUTES: int = 60
+    SECONDS_IN_HOUR: int = 3600
+    POSITIVE_FIELDS: FrozenSet[str] = frozenset(('duration', 'weight'))
 
     def __init__(self,
                  action: int,
@@ -35,9 +305,13 @@ class Training:
                  ) -> None:
         self.action = action
         self.duration = duration
-        self.duration_min = self.duration * self.HOURS_IN_MINUTES
         self.weight = weight
 
+    @property
+    def duration_min(self) -> float:
+        """Длительность тренировки в минутах."""
+        return self.duration * self.HOURS_IN_MINUTES
+
     def get_distance(self) -> float:
         """Получить дистанцию в км."""
         return self.action * self.LEN_STEP / self.M_IN_KM
@@ -59,7 +333,45 @@ class Training:
                            self.get_mean_speed(),
                            self.get_spent_calories())
 
+    @classmethod
+    def from_series(cls,
+                    series: SampleSeries,
+                    *args: float,
+                    start: int = 0,
+                    stop: Optional[int] = None
+                    ) -> 'Training':
+        """Создать тренировку по посекундным отсчётам шагов.
+
+        `action` - сумма отсчётов диапазона, длительность - число отсчётов
+        в часах; остальные поля конструктора передаются в `args`.
+        """
+        duration = series.count(start, stop) / cls.SECONDS_IN_HOUR
+        return cls(series.total(start, stop), duration, *args)
+
+    @classmethod
+    def get_batch_distance(cls, columns: Sequence[np.ndarray]) -> np.ndarray:
+        """Получить дистанцию в км для массива тренировок."""
+        return columns[0] * cls.LEN_STEP / cls.M_IN_KM
+
+    @classmethod
+    def get_batch_mean_speed(cls,
+                             columns: Sequence[np.ndarray],
+                             distance: np.ndarray
+                             ) -> np.ndarray:
+        """Получить среднюю скорость для массива тренировок."""
+        return distance / columns[1]
+
+    @classmethod
+    def get_batch_spent_calories(cls,
+                                 columns: Sequence[np.ndarray],
+                                 speed: np.ndarray
+                                 ) -> np.ndarray:
+        """Получить затраченные калории для массива тренировок."""
+        raise NotImplementedError(f'Переопределите get_batch_spent_calories() '
+                                  f'в {cls.__name__}')
 
+
+@register_training('RUN')
 class Running(Training):
     """Тренировка: бег."""
     R_COEFF_CAL_1: int = 18
@@ -78,12 +390,25 @@ class Running(Training):
                    - self.R_COEFF_CAL_2) * self.weight) / self.M_IN_KM)
                 * self.duration_min)
 
+    @classmethod
+    def get_batch_spent_calories(cls,
+                                 columns: Sequence[np.ndarray],
+                                 speed: np.ndarray
+                                 ) -> np.ndarray:
+        """Получить затраченные калории для массива тренировок."""
+        duration, weight = columns[1], columns[2]
+        return ((((cls.R_COEFF_CAL_1 * speed
+                   - cls.R_COEFF_CAL_2) * weight) / cls.M_IN_KM)
+                * (duration * cls.HOURS_IN_MINUTES))
+
 
+@register_training('WLK')
 class SportsWalking(Training):
     """Тренировка: спортивная ходьба."""
     W_COEFF_CAL_1: float = 0.035
     W_COEFF_CAL_2: float = 0.029
     W_COEFF_CAL_3: int = 2
+    POSITIVE_FIELDS = Training.POSITIVE_FIELDS | {'height'}
 
     def __init__(self,
                  action: int,
@@ -100,12 +425,52 @@ class SportsWalking(Training):
                 + ((self.get_mean_speed() ** self.W_COEFF_CAL_3 // self.height)
                 * self.W_COEFF_CAL_2 * self.height)) * self.duration_min
 
+    @classmethod
+    def get_batch_spent_calories(cls,
+                                 columns: Sequence[np.ndarray],
+                                 speed: np.ndarray
+                                 ) -> np.ndarray:
+        """Получить затраченные калории для массива тренировок."""
+        duration, weight, height = columns[1], columns[2], columns[3]
+        return ((cls.W_COEFF_CAL_1 * weight)
+                + (cls._get_batch_quotient(speed, height)
+                * cls.W_COEFF_CAL_2 * height)) * (duration
+                                                  * cls.HOURS_IN_MINUTES)
+
+    @classmethod
+    def _get_batch_quotient(cls,
+                            speed: np.ndarray,
+                            height: np.ndarray
+                            ) -> np.ndarray:
+        """Получить `speed ** W_COEFF_CAL_3 // height` как в скалярной формуле.
+
+        `float ** int` в Python вызывает libm `pow`, который расходится с
+        векторным возведением в степень NumPy на несколько ULP. На частное
+        это влияет, только если степень лежит у кратного `height`, поэтому
+        скалярно пересчитываются лишь такие строки.
+        """
+        speed_pow = speed ** cls.W_COEFF_CAL_3
+        quotient = speed_pow // height
+        remainder = np.fmod(speed_pow, height)
+        margin = 8 * np.spacing(speed_pow)
+        exact = np.flatnonzero(~np.isfinite(speed_pow)
+                               | (remainder <= margin)
+                               | (height - remainder <= margin))
+        if len(exact):
+            quotient[exact] = [value ** cls.W_COEFF_CAL_3 // divisor
+                               for value, divisor in zip(
+                                   speed[exact].tolist(),
+                                   height[exact].tolist())]
+        return quotient
 
+
+@register_training('SWM')
 class Swimming(Training):
     """Тренировка: плавание."""
     LEN_STEP: float = 1.38
     SWIM_COEFF_CAL_1: float = 1.1
     SWIM_COEFF_CAL_2: int = 2
+    POSITIVE_FIELDS = Training.POSITIVE_FIELDS | {'length_pool'}
 
     def __init__(self,
                  action: int,
@@ -132,16 +497,2226 @@ class Swimming(Training):
         return ((self.get_mean_speed() + self.SWIM_COEFF_CAL_1)
                 * self.SWIM_COEFF_CAL_2) * self.weight
 
+    @classmethod
+    def from_series(cls,
+                    series: SampleSeries,
+                    weight: float,
+                    length_pool: int,
+                    strokes: SampleSeries,
+                    start: int = 0,
+                    stop: Optional[int] = None
+                    ) -> 'Swimming':
+        """Создать тренировку по посекундным отсчётам бассейнов и гребков.
+
+        `count_pool` - сумма отсчётов `series`, `action` - сумма гребков
+        `strokes` за тот же диапазон.
+        """
+        duration = series.count(start, stop) / cls.SECONDS_IN_HOUR
+        return cls(strokes.total(start, stop), duration, weight,
+                   length_pool, series.total(start, stop))
+
+    @classmethod
+    def get_batch_distance(cls, columns: Sequence[np.ndarray]) -> np.ndarray:
+        """Получить дистанцию в км для массива тренировок."""
+        return columns[0] * cls.LEN_STEP / cls.M_IN_KM
+
+    @classmethod
+    def get_batch_mean_speed(cls,
+                             columns: Sequence[np.ndarray],
+                             distance: np.ndarray
+                             ) -> np.ndarray:
+        """Получить среднюю скорость для массива тренировок."""
+        duration, length_pool, count_pool = columns[1], columns[3], columns[4]
+        return ((length_pool * count_pool) / cls.M_IN_KM) / duration
+
+    @classmethod
+    def get_batch_spent_calories(cls,
+                                 columns: Sequence[np.ndarray],
+                                 speed: np.ndarray
+                                 ) -> np.ndarray:
+        """Получить затраченные калории для массива тренировок."""
+        weight = columns[2]
+        return ((speed + cls.SWIM_COEFF_CAL_1)
+                * cls.SWIM_COEFF_CAL_2) * weight
+
+
+def _discover_plugins() -> Dict[str, object]:
+    """Найти точки входа плагинов тренировок, не импортируя их модули."""
+    from importlib import metadata
+    try:
+        entry_points = metadata.entry_points(group=PLUGIN_GROUP)
+    except TypeError:
+        entry_points = metadata.entry_points().get(PLUGIN_GROUP, [])
+    return {entry_point.name: entry_point for entry_point in entry_points
+            if entry_point.name not in TRAINING_TYPES}
+
+
+def find_training_class(workout_type_def: str) -> Optional[Type[Training]]:
+    """Найти класс тренировки по коду, при необходимости загрузив плагин.
+
+    Точки входа ищутся один раз при первом неизвестном коде, а модуль
+    плагина импортируется только когда его код встретился в пакете.
+    Точка входа может указывать на класс или на модуль, который
+    регистрирует классы через `register_training`.
+    """
+    global _plugins
+    training_class = TRAINING_TYPES.get(workout_type_def)
+    if training_class is not None:
+        return training_class
+    if _plugins is None:
+        _plugins = _discover_plugins()
+    entry_point = _plugins.pop(workout_type_def, None)
+    if entry_point is not None:
+        loaded = entry_point.load()
+        if isinstance(loaded, type) and issubclass(loaded, Training):
+            TRAINING_TYPES.setdefault(workout_type_def, loaded)
+    return TRAINING_TYPES.get(workout_type_def)
+
 
 def read_package(workout_type_def: str, data_def: list) -> Training:
     """Прочитать данные полученные от датчиков."""
-    type_of_training: Dict[str, Type[Training]] = {"SWM": Swimming,
-                                                   "RUN": Running,
-                                                   "WLK": SportsWalking}
-    if workout_type_def not in type_of_training:
+    training_class = TRAINING_TYPES.get(workout_type_def)
+    if training_class is None:
+        training_class = find_training_class(workout_type_def)
+    if training_class is None:
         raise ValueError('Неккоректный тип тренировки')
-    else:
-        return type_of_training[workout_type_def](*data_def)
+    return training_class(*data_def)
+
+
+_arity: Dict[Type[Training], int] = {}
+
+
+def get_arity(training_class: Type[Training]) -> int:
+    """Вернуть число полей пакета для класса тренировки."""
+    if training_class not in _arity:
+        _arity[training_class] = (
+            training_class.__init__.__code__.co_argcount - 1)
+    return _arity[training_class]
+
+
+def _slotted_init(fields: Tuple[str, ...]) -> Callable[..., None]:
+    """Построить `__init__`, заполняющий слоты по порядку аргументов."""
+    def __init__(self: object, *values: float) -> None:
+        if len(values) != len(fields):
+            raise TypeError(f'{type(self).__qualname__}() ожидает '
+                            f'{len(fields)} аргументов, получено '
+                            f'{len(values)}')
+        for name, value in zip(fields, values):
+            setattr(self, name, value)
+    return __init__
+
+
+@lru_cache(maxsize=None)
+def slotted_training(training_class: Type[Training]) -> type:
+    """Вернуть компактный вариант класса тренировки на `__slots__`.
+
+    Экземпляры хранят только поля конструктора, без `__dict__`. Формулы
+    и константы копируются из иерархии класса, а имя класса сохраняется,
+    поэтому `show_training_info` возвращает те же сообщения. Подходит
+    для классов, конструктор которых только сохраняет свои аргументы.
+    """
+    fields = training_class.__init__.__code__.co_varnames[
+        1:get_arity(training_class) + 1]
+    namespace: Dict[str, object] = {}
+    for klass in reversed(training_class.__mro__[:-1]):
+        namespace.update(vars(klass))
+    for name in ('__dict__', '__weakref__'):
+        namespace.pop(name, None)
+    namespace['__slots__'] = fields
+    namespace['__init__'] = _slotted_init(fields)
+    namespace['__qualname__'] = f'Slotted{training_class.__name__}'
+    return type(training_class.__name__, (), namespace)
+
+
+def _compile_validator(training_class: Type[Training]
+                       ) -> Callable[[Sequence], Optional[str]]:
+    """Построить проверку полей пакета для класса тренировки."""
+    arity = get_arity(training_class)
+    names = training_class.__init__.__code__.co_varnames[1:arity + 1]
+    positive = [name in training_class.POSITIVE_FIELDS for name in names]
+    checks = list(zip(names, positive))
+
+    def validate(data_def: Sequence) -> Optional[str]:
+        if len(data_def) != arity:
+            return (f'{training_class.__name__}: ожидается {arity} полей, '
+                    f'получено {len(data_def)}')
+        for (name, strict), value in zip(checks, data_def):
+            if (isinstance(value, bool)
+                    or not isinstance(value, numbers.Real)
+                    or not math.isfinite(value)):
+                return f'{training_class.__name__}: поле {name} не число'
+            if value < 0 or strict and value == 0:
+                return (f'{training_class.__name__}: поле {name} должно '
+                        f'быть {"больше" if strict else "не меньше"} нуля')
+        return None
+    return validate
+
+
+_validators: Dict[Type[Training], Callable[[Sequence], Optional[str]]] = {}
+
+
+def check_package(workout_type_def: str, data_def: Sequence
+                  ) -> Optional[str]:
+    """Проверить пакет без исключений, вернуть описание ошибки или None.
+
+    Проверяются код тренировки, число полей, их типы и допустимые
+    значения: поля из `POSITIVE_FIELDS` больше нуля, остальные не меньше.
+    """
+    training_class = find_training_class(workout_type_def)
+    if training_class is None:
+        return 'Неккоректный тип тренировки'
+    validate = _validators.get(training_class)
+    if validate is None:
+        validate = _validators[training_class] = _compile_validator(
+            training_class)
+    return validate(data_def)
+
+
+def validate_batch(workout_types: Sequence[Union[str, bytes]],
+                   columns: Sequence[Sequence[float]]
+                   ) -> np.ndarray:
+    """Вернуть маску корректных строк колоночного пакета.
+
+    Проверка выполняется над колонками целиком, неизвестные коды и
+    недопустимые значения дают False в соответствующих строках.
+    """
+    codes, inverse = np.unique(np.asarray(workout_types),
+                               return_inverse=True)
+    arrays = [np.asarray(column, dtype=np.float64) for column in columns]
+    mask = np.zeros(len(inverse), dtype=bool)
+    for number, workout_type_def in enumerate(codes.tolist()):
+        if isinstance(workout_type_def, bytes):
+            workout_type_def = workout_type_def.decode('ascii')
+        training_class = find_training_class(workout_type_def)
+        if training_class is None:
+            continue
+        rows = np.flatnonzero(inverse == number)
+        arity = get_arity(training_class)
+        names = training_class.__init__.__code__.co_varnames[1:arity + 1]
+        valid = np.full(len(rows), len(arrays) >= arity)
+        for name, column in zip(names, arrays):
+            values = column[rows]
+            valid &= np.isfinite(values)
+            if name in training_class.POSITIVE_FIELDS:
+                valid &= values > 0
+            else:
+                valid &= values >= 0
+        mask[rows] = valid
+    return mask
+
+
+def compute_batch(workout_types: Sequence[Union[str, bytes]],
+                  columns: Sequence[Sequence[float]]
+                  ) -> Dict[str, list]:
+    """Рассчитать показатели для колоночного пакета тренировок.
+
+    `columns[j][i]` соответствует `data_def[j]` i-го пакета, неиспользуемые
+    типом тренировки поля могут быть любыми числами. Коды тренировок
+    принимаются строками или байтами, в том числе массивом NumPy.
+    Классы, в которых формулы переопределены без пакетных вариантов,
+    рассчитываются построчно через объекты тренировок.
+    """
+    codes, inverse = np.unique(np.asarray(workout_types),
+                               return_inverse=True)
+    size = len(inverse)
+    arrays = [np.asarray(column, dtype=np.float64) for column in columns]
+    result: Dict[str, list] = {
+        'training_type': np.empty(size, dtype=object),
+        'duration': np.empty(size, dtype=np.float64),
+        'distance': np.empty(size, dtype=np.float64),
+        'speed': np.empty(size, dtype=np.float64),
+        'calories': np.empty(size, dtype=np.float64),
+    }
+    for number, workout_type_def in enumerate(codes.tolist()):
+        if isinstance(workout_type_def, bytes):
+            workout_type_def = workout_type_def.decode('ascii')
+        training_class = find_training_class(workout_type_def)
+        if training_class is None:
+            raise ValueError('Неккоректный тип тренировки')
+        rows = np.flatnonzero(inverse == number)
+        group = [column[rows] for column in arrays]
+        if has_batch_formulas(training_class):
+            distance, speed, calories = _calculate_group(training_class,
+                                                         group)
+        else:
+            distance, speed, calories = _calculate_objects(training_class,
+                                                           group)
+        result['training_type'][rows] = training_class.__name__
+        result['duration'][rows] = group[1]
+        result['distance'][rows] = distance
+        result['speed'][rows] = speed
+        result['calories'][rows] = calories
+    result['training_type'] = result['training_type'].tolist()
+    return result
+
+
+BATCH_FORMULAS = (('get_distance', 'get_batch_distance'),
+                  ('get_mean_speed', 'get_batch_mean_speed'),
+                  ('get_spent_calories', 'get_batch_spent_calories'))
+
+
+def _defining_class(training_class: Type[Training], name: str) -> type:
+    """Вернуть класс иерархии, в котором определён атрибут."""
+    return next(klass for klass in training_class.__mro__
+                if name in vars(klass))
+
+
+@lru_cache(maxsize=None)
+def has_batch_formulas(training_class: Type[Training]) -> bool:
+    """Проверить, соответствуют ли пакетные формулы класса скалярным.
+
+    Пакетная формула годится, только если она определена в том же классе,
+    что и скалярная, или ниже по иерархии: иначе подкласс изменил расчёт,
+    а пакетный путь унаследовал бы формулу родителя.
+    """
+    return all(issubclass(_defining_class(training_class, batch),
+                          _defining_class(training_class, scalar))
+               for scalar, batch in BATCH_FORMULAS)
+
+
+def _calculate_objects(training_class: Type[Training],
+                       columns: Sequence[np.ndarray]
+                       ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Рассчитать показатели группы построчно через объекты тренировок."""
+    rows = zip(*(column.tolist()
+                 for column in columns[:get_arity(training_class)]))
+    infos = [training_class(*row).show_training_info() for row in rows]
+    return tuple(np.array([getattr(info, field) for info in infos],
+                          dtype=np.float64)
+                 for field in ('distance', 'speed', 'calories'))
+
+
+def _calculate_group(training_class: Type[Training],
+                     columns: Sequence[np.ndarray]
+                     ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Рассчитать дистанцию, скорость и калории для одного типа тренировки."""
+    distance = training_class.get_batch_distance(columns)
+    speed = training_class.get_batch_mean_speed(columns, distance)
+    calories = training_class.get_batch_spent_calories(columns, speed)
+    return distance, speed, calories
+
+
+class ResultCache:
+    """Ограниченный кэш результатов по типу тренировки и данным пакета.
+
+    Политика вытеснения `lru` или `fifo`, `ttl` задаёт время жизни записи
+    в секундах. При указании `path` промахи дополнительно ищутся в общем
+    файле SQLite, который могут использовать несколько процессов; в нём
+    хранится не больше `store_size` записей (с запасом в PRUNE_INTERVAL
+    вставок между очистками), устаревшие записи удаляются.
+    Возвращаемые `InfoMessage` общие для всех попаданий и не должны
+    изменяться.
+    """
+    POLICIES = ('lru', 'fifo')
+    PRUNE_INTERVAL = 1000
+
+    def __init__(self,
+                 maxsize: int = 65536,
+                 ttl: Optional[float] = None,
+                 policy: str = 'lru',
+                 path: Optional[str] = None,
+                 store_size: int = 1000000
+                 ) -> None:
+        if policy not in self.POLICIES:
+            raise ValueError(f'Неизвестная политика вытеснения {policy}')
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.policy = policy
+        self.store_size = store_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._store: Optional[sqlite3.Connection] = None
+        if path is not None:
+            self._store = sqlite3.connect(path, timeout=30,
+                                          isolation_level=None)
+            self._store.execute('PRAGMA journal_mode=WAL')
+            self._store.execute(
+                'CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, '
+                'created REAL, training_type TEXT, duration REAL, '
+                'distance REAL, speed REAL, calories REAL)')
+            self._store.execute('CREATE INDEX IF NOT EXISTS results_created '
+                                'ON results (created)')
+            self._inserts = 0
+            self.prune()
+
+    def get(self, workout_type_def: str, data_def: Sequence) -> InfoMessage:
+        """Вернуть результат пакета, рассчитав его только при промахе."""
+        key = (workout_type_def, tuple(data_def))
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None and self._is_fresh(entry[0], now):
+            self.hits += 1
+            if self.policy == 'lru':
+                self._entries.move_to_end(key)
+            return entry[1]
+        info = self._load(key, now)
+        if info is None:
+            self.misses += 1
+            info = read_package(workout_type_def,
+                                list(data_def)).show_training_info()
+            self._save(key, now, info)
+        else:
+            self.hits += 1
+        self._entries[key] = (now, info)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return info
+
+    def _is_fresh(self, created: float, now: float) -> bool:
+        """Проверить, не истекло ли время жизни записи."""
+        return self.ttl is None or now - created < self.ttl
+
+    def _load(self, key: Tuple, now: float) -> Optional[InfoMessage]:
+        """Найти результат в общем файле."""
+        if self._store is None:
+            return None
+        row = self._store.execute(
+            'SELECT created, training_type, duration, distance, speed, '
+            'calories FROM results WHERE key = ?', (json.dumps(key),)
+        ).fetchone()
+        if row is None or not self._is_fresh(row[0], now):
+            return None
+        return InfoMessage(*row[1:])
+
+    def _save(self, key: Tuple, now: float, info: InfoMessage) -> None:
+        """Сохранить результат в общий файл."""
+        if self._store is not None:
+            self._store.execute(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (json.dumps(key), now, info.training_type, info.duration,
+                 info.distance, info.speed, info.calories))
+            self._inserts += 1
+            if self._inserts >= self.PRUNE_INTERVAL:
+                self.prune()
+
+    def prune(self) -> None:
+        """Удалить из общего файла устаревшие и самые старые записи."""
+        if self._store is None:
+            return
+        self._inserts = 0
+        if self.ttl is not None:
+            self._store.execute('DELETE FROM results WHERE created <= ?',
+                                (time.time() - self.ttl,))
+        self._store.execute(
+            'DELETE FROM results WHERE created <= (SELECT created FROM '
+            'results ORDER BY created DESC LIMIT 1 OFFSET ?)',
+            (self.store_size,))
+
+    def stats(self) -> Dict[str, int]:
+        """Вернуть статистику попаданий и промахов."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._entries)}
+
+    def clear(self) -> None:
+        """Очистить кэш в памяти и сбросить статистику."""
+        self._entries.clear()
+        self.hits = self.misses = 0
+
+    def close(self) -> None:
+        """Закрыть общий файл."""
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+
+
+Package = Tuple[str, list]
+ErrorHandler = Callable[[object, Exception], None]
+
+DEMO_PACKAGES: List[Package] = [
+    ('SWM', [720, 1, 80, 25, 40]),
+    ('RUN', [15000, 1, 75]),
+    ('WLK', [9000, 1, 75, 180]),
+]
+
+PACKAGE_ERRORS = (ValueError, TypeError, KeyError, IndexError,
+                  ZeroDivisionError)
+
+
+def _parse_number(value: str) -> Union[int, float]:
+    """Преобразовать поле пакета в число."""
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def _coerce_fields(data_def: Iterable) -> list:
+    """Преобразовать строковые поля пакета в числа."""
+    return [_parse_number(value) if isinstance(value, str) else value
+            for value in data_def]
+
+
+def parse_package(raw: Union[str, Sequence]) -> Package:
+    """Разобрать пакет из кортежа, строки CSV или строки JSON.
+
+    Поддерживаются строки вида `RUN,15000,1,75`, `["RUN", [15000, 1, 75]]`
+    и `{"type": "RUN", "data": [15000, 1, 75]}`.
+    """
+    if not isinstance(raw, str):
+        workout_type_def, data_def = raw
+        return workout_type_def, list(data_def)
+    line = raw.strip()
+    if line.startswith(('[', '{')):
+        value = json.loads(line)
+        if isinstance(value, dict):
+            return value['type'], _coerce_fields(value['data'])
+        workout_type_def, data_def = value
+        return workout_type_def, _coerce_fields(data_def)
+    workout_type_def, *fields = line.split(',')
+    return workout_type_def.strip(), [_parse_number(field)
+                                      for field in fields]
+
+
+def parse_device_package(raw: Union[str, Sequence]
+                         ) -> Tuple[Optional[str], Package]:
+    """Разобрать пакет вместе с идентификатором устройства, если он есть.
+
+    Идентификатор передаётся полем `device` объекта JSON
+    (`{"type": "RUN", "data": [15000, 1, 75], "device": "tracker-1"}`)
+    или третьим элементом кортежа или списка JSON.
+    """
+    if isinstance(raw, str):
+        line = raw.strip()
+        if not line.startswith(('[', '{')):
+            return None, parse_package(line)
+        raw = json.loads(line)
+        if isinstance(raw, dict):
+            device = raw.get('device')
+            return (None if device is None else str(device),
+                    (raw['type'], _coerce_fields(raw['data'])))
+        raw = [raw[0], _coerce_fields(raw[1]), *raw[2:]]
+    if len(raw) == 3:
+        workout_type_def, data_def, device = raw
+        return str(device), (workout_type_def, list(data_def))
+    return None, parse_package(raw)
+
+
+def report_error(package: object, error: Exception) -> None:
+    """Сообщить о некорректном пакете в stderr."""
+    print(f'Пропущен пакет {package!r}: {error}', file=sys.stderr)
+
+
+def iter_packages(source: Iterable,
+                  errors: ErrorHandler = report_error
+                  ) -> Iterator[Package]:
+    """Лениво читать пакеты из итерируемого источника или файла."""
+    for raw in source:
+        if isinstance(raw, str) and not raw.strip():
+            continue
+        try:
+            yield parse_package(raw)
+        except PACKAGE_ERRORS as error:
+            errors(raw, error)
+
+
+class PacketDeduplicator:
+    """Отбрасывание повторно присланных пакетов (вращающийся фильтр Блума).
+
+    Помнит последние `window`-`2 * window` ключей в двух поколениях
+    фильтра, доля ложных срабатываний не превышает `error_rate`. Ключ -
+    идентификатор устройства и хэш содержимого пакета. При указании
+    `path` состояние загружается из файла. Сохраняет его вызывающий код
+    через `checkpoint` после записи результатов пропущенных пакетов, не
+    чаще раза в `save_interval` секунд; после сбоя пакеты с последней
+    контрольной точки обрабатываются повторно, но не теряются.
+    """
+    MAGIC = b'FTRKDUP1'
+    HEADER = struct.Struct('<dQQQQ')
+
+    def __init__(self,
+                 window: int = 1000000,
+                 error_rate: float = 0.001,
+                 path: Optional[str] = None,
+                 save_interval: float = 60.0
+                 ) -> None:
+        if window < 1 or not 0 < error_rate < 1:
+            raise ValueError('Некорректные параметры фильтра повторов')
+        self.window = window
+        self.error_rate = error_rate
+        self.path = path
+        self.save_interval = save_interval
+        self.dropped = 0
+        rate = error_rate / 2
+        self.bits = max(int(-window * math.log(rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.bits / window * math.log(2)), 1)
+        self._added = 0
+        self._current = bytearray((self.bits + 7) // 8)
+        self._previous = bytearray(len(self._current))
+        self._marks: deque = deque()
+        self._marked = time.monotonic()
+        self._deadline = time.monotonic() + save_interval
+        if path is not None and os.path.exists(path):
+            self._load(path)
+
+    def _positions(self, key: bytes) -> List[int]:
+        """Вернуть номера битов ключа (двойное хэширование)."""
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.bits
+                for i in range(self.hashes)]
+
+    @staticmethod
+    def _contains(bits: bytearray, positions: List[int]) -> bool:
+        """Проверить, установлены ли все биты в поколении."""
+        return all(bits[i >> 3] & (1 << (i & 7)) for i in positions)
+
+    def seen(self,
+             workout_type_def: str,
+             data_def: Sequence,
+             device: str
+             ) -> bool:
+        """Учесть пакет и сообщить, встречался ли он в окне раньше."""
+        key = json.dumps([device, workout_type_def, list(data_def)])
+        positions = self._positions(key.encode())
+        if self._contains(self._current, positions):
+            self.dropped += 1
+            return True
+        duplicate = self._contains(self._previous, positions)
+        if self._added >= self.window:
+            self._previous = self._current
+            self._current = bytearray(len(self._previous))
+            self._added = 0
+        for i in positions:
+            self._current[i >> 3] |= 1 << (i & 7)
+        self._added += 1
+        if duplicate:
+            self.dropped += 1
+        return duplicate
+
+    def filter(self,
+               source: Iterable,
+               errors: ErrorHandler = report_error
+               ) -> Iterator[Package]:
+        """Разобрать пакеты и пропустить те, что не встречались в окне.
+
+        Проверяются только пакеты с идентификатором устройства (см.
+        `parse_device_package`); одинаковые тренировки без него могут
+        прийти от разных устройств и пропускаются без проверки.
+        """
+        seen = self.seen
+        for raw in source:
+            if isinstance(raw, str) and not raw.strip():
+                continue
+            try:
+                device, package = parse_device_package(raw)
+            except PACKAGE_ERRORS as error:
+                errors(raw, error)
+                continue
+            if device is None or not seen(*package, device):
+                yield package
+
+    def mark_chunks(self, packages: Iterable[Package], size: int
+                    ) -> Iterator[Package]:
+        """Пропустить пакеты, запоминая состояние фильтра на границах частей.
+
+        Нужно, когда пакеты читаются раньше, чем выводятся результаты
+        (`process_parallel` с частями по `size` пакетов): состояние
+        запоминается не чаще раза в `save_interval` секунд и в конце
+        источника, а `checkpoint(handled)` сохраняет подходящее.
+        """
+        count = 0
+        for count, package in enumerate(packages, 1):
+            yield package
+            if (not count % size
+                    and time.monotonic() - self._marked >= self.save_interval):
+                self._marks.append((count, self._state()))
+                self._marked = time.monotonic()
+        self._marks.append((count, self._state()))
+
+    def checkpoint(self,
+                   handled: Optional[int] = None,
+                   force: bool = False
+                   ) -> None:
+        """Сохранить состояние, если прошло `save_interval` секунд.
+
+        Без `handled` сохраняется текущее состояние: результаты всех
+        пропущенных `filter` пакетов должны быть уже записаны. Иначе
+        сохраняется последнее состояние `mark_chunks`, покрывающее не больше
+        `handled` пакетов с записанным результатом или ошибкой.
+        """
+        if self.path is None:
+            return
+        state = None
+        if handled is not None:
+            marks = self._marks
+            while len(marks) > 1 and marks[1][0] <= handled:
+                marks.popleft()
+            if not marks or marks[0][0] > handled:
+                return
+            state = marks[0][1]
+        if force or time.monotonic() >= self._deadline:
+            self.save(state)
+            self._deadline = time.monotonic() + self.save_interval
+
+    def _state(self) -> bytes:
+        """Вернуть состояние фильтра в формате файла."""
+        return b''.join((self.MAGIC,
+                         self.HEADER.pack(self.error_rate, self.window,
+                                          self.bits, self._added,
+                                          self.dropped),
+                         self._current, self._previous))
+
+    def save(self, state: Optional[bytes] = None) -> None:
+        """Атомарно сохранить состояние фильтра (по умолчанию текущее)."""
+        if self.path is None:
+            raise ValueError('Не указан файл состояния фильтра повторов')
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(self._state() if state is None else state)
+        os.replace(temporary, self.path)
+
+    def _load(self, path: str) -> None:
+        """Загрузить состояние фильтра, сохранённое с теми же параметрами."""
+        with open(path, 'rb') as file:
+            data = file.read()
+        if not data.startswith(self.MAGIC):
+            raise ValueError(f'{path} не является файлом фильтра повторов')
+        error_rate, window, bits, added, dropped = self.HEADER.unpack_from(
+            data, len(self.MAGIC))
+        if (error_rate, window, bits) != (self.error_rate, self.window,
+                                          self.bits):
+            raise ValueError(f'{path} сохранён с другими параметрами')
+        offset = len(self.MAGIC) + self.HEADER.size
+        size = len(self._current)
+        self._current[:] = data[offset:offset + size]
+        self._previous[:] = data[offset + size:offset + 2 * size]
+        self._added = added
+        self.dropped = dropped
+
+
+def process_stream(source: Iterable,
+                   errors: ErrorHandler = report_error,
+                   as_text: bool = False,
+                   cache: Optional[ResultCache] = None
+                   ) -> Iterator[Union[InfoMessage, str]]:
+    """Обработать поток пакетов, некорректные пакеты передать в `errors`.
+
+    Пакеты проверяются `check_package` до расчёта, поэтому ошибки в данных
+    не приводят к исключениям внутри классов тренировок.
+    """
+    for package in iter_packages(source, errors):
+        info = _calculate_package(package, errors, cache)
+        if info is not None:
+            yield info.get_message() if as_text else info
+
+
+def process_device_stream(source: Iterable,
+                          errors: ErrorHandler = report_error,
+                          cache: Optional[ResultCache] = None
+                          ) -> Iterator[Tuple[Optional[str], InfoMessage]]:
+    """Обработать поток пакетов, сохраняя идентификаторы устройств.
+
+    Пакеты разбираются `parse_device_package`; возвращаются пары
+    `(device, info)`, которые принимает `StreamStats.track`.
+    """
+    for raw in source:
+        if isinstance(raw, str) and not raw.strip():
+            continue
+        try:
+            device, package = parse_device_package(raw)
+        except PACKAGE_ERRORS as error:
+            errors(raw, error)
+            continue
+        info = _calculate_package(package, errors, cache)
+        if info is not None:
+            yield device, info
+
+
+def _calculate_package(package: Package,
+                       errors: ErrorHandler,
+                       cache: Optional[ResultCache]
+                       ) -> Optional[InfoMessage]:
+    """Проверить пакет и рассчитать тренировку; ошибки передать в `errors`."""
+    workout_type_def, data_def = package
+    problem = check_package(workout_type_def, data_def)
+    if problem is not None:
+        errors(package, ValueError(problem))
+        return None
+    try:
+        if cache is not None:
+            return cache.get(workout_type_def, data_def)
+        return read_package(workout_type_def, data_def).show_training_info()
+    except PACKAGE_ERRORS as error:
+        errors(package, error)
+        return None
+
+
+BINARY_MAGIC = b'FTRKBIN1'
+BINARY_RECORD = struct.Struct('<3sxI4d')
+BINARY_FIELDS = 5
+
+
+@lru_cache(maxsize=None)
+def get_binary_dtype() -> np.dtype:
+    """Вернуть тип NumPy, соответствующий бинарной записи пакета."""
+    return np.dtype([('workout_type', 'S3'), ('padding', 'V1'),
+                     ('action', '<u4'), ('duration', '<f8'),
+                     ('weight', '<f8'), ('extra_1', '<f8'),
+                     ('extra_2', '<f8')])
+
+
+def write_binary(path: str, packages: Iterable[Package]) -> int:
+    """Записать пакеты в бинарный файл записями фиксированной длины.
+
+    Запись: код тренировки (3 байта), `action` (uint32) и до четырёх
+    float64 полей; неиспользуемые поля заполняются нулями. Коды другой
+    длины и дробный `action` не помещаются в запись без искажений и
+    вызывают `ValueError`.
+    """
+    count = 0
+    with open(path, 'wb') as file:
+        file.write(BINARY_MAGIC)
+        for workout_type_def, data_def in packages:
+            if len(data_def) > BINARY_FIELDS:
+                raise ValueError(f'Пакет {workout_type_def} не помещается '
+                                 f'в бинарную запись')
+            code = workout_type_def.encode('ascii')
+            if len(code) != 3:
+                raise ValueError(f'Код тренировки {workout_type_def} должен '
+                                 f'состоять из трёх символов')
+            action, *values = data_def
+            if isinstance(action, float):
+                if not action.is_integer():
+                    raise ValueError(f'Поле action {action} не целое')
+                action = int(action)
+            if not 0 <= action <= 0xFFFFFFFF:
+                raise ValueError(f'Поле action {action} вне диапазона uint32')
+            values += [0.0] * (BINARY_FIELDS - 1 - len(values))
+            file.write(BINARY_RECORD.pack(code, action, *values))
+            count += 1
+    return count
+
+
+def _map_binary(file: BinaryIO) -> mmap.mmap:
+    """Отобразить бинарный файл в память и проверить заголовок."""
+    mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+        mapped.close()
+        raise ValueError('Файл не является бинарным архивом пакетов')
+    return mapped
+
+
+def read_binary(path: str) -> Iterator[Package]:
+    """Лениво читать пакеты из бинарного файла через `mmap`."""
+    with open(path, 'rb') as file, _map_binary(file) as mapped:
+        view = memoryview(mapped)[len(BINARY_MAGIC):]
+        records = BINARY_RECORD.iter_unpack(view)
+        try:
+            for code, action, *values in records:
+                workout_type_def = code.decode('ascii')
+                training_class = find_training_class(workout_type_def)
+                arity = (get_arity(training_class) if training_class
+                         else BINARY_FIELDS)
+                yield workout_type_def, [action, *values[:arity - 1]]
+        finally:
+            del records
+            view.release()
+
+
+def read_binary_columns(path: str) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """Вернуть коды и колонки бинарного файла для `compute_batch`.
+
+    Колонки являются представлениями поверх отображённого в память файла,
+    данные не копируются до группировки по типу тренировки.
+    """
+    with open(path, 'rb') as file:
+        mapped = _map_binary(file)
+    records = np.frombuffer(mapped, dtype=get_binary_dtype(),
+                            offset=len(BINARY_MAGIC))
+    columns = [records[name] for name in ('action', 'duration', 'weight',
+                                          'extra_1', 'extra_2')]
+    return records['workout_type'], columns
+
+
+_worker_cache: Optional[ResultCache] = None
+
+
+def _process_chunk(chunk: List,
+                   as_text: bool,
+                   cache_options: Optional[Dict] = None,
+                   measure: bool = False
+                   ) -> Tuple[list, List[Tuple[object, Exception]],
+                              Optional[Tuple]]:
+    """Обработать часть пакетов в процессе-исполнителе.
+
+    При `measure` вместе с результатами возвращаются замеры этапов,
+    накопленные при обработке части.
+    """
+    global _worker_cache
+    if cache_options is not None and _worker_cache is None:
+        _worker_cache = ResultCache(**cache_options)
+    if measure:
+        instrumentation.enable()
+        instrumentation.reset()
+    errors: List[Tuple[object, Exception]] = []
+    results = list(process_stream(
+        chunk, lambda package, error: errors.append((package, error)),
+        as_text, _worker_cache if cache_options is not None else None))
+    return results, errors, instrumentation.snapshot() if measure else None
+
+
+def process_parallel(source: Iterable,
+                     errors: ErrorHandler = report_error,
+                     as_text: bool = False,
+                     workers: Optional[int] = None,
+                     chunk_size: int = 10000,
+                     cache_options: Optional[Dict] = None
+                     ) -> Iterator[Union[InfoMessage, str]]:
+    """Обработать поток пакетов на нескольких ядрах с сохранением порядка.
+
+    Одновременно в работе находится не больше `2 * workers` частей, поэтому
+    потребление памяти не зависит от размера источника. `cache_options`
+    передаются в `ResultCache` каждого процесса; с `path` процессы
+    используют общий файл кэша. Если включено `instrumentation`, замеры
+    процессов-исполнителей добавляются к нему.
+    """
+    source = iter(source)
+    workers = workers or os.cpu_count() or 1
+    measure = instrumentation.enabled
+    with futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        pending: deque = deque()
+        max_pending = 2 * workers
+        while True:
+            while len(pending) < max_pending:
+                chunk = list(islice(source, chunk_size))
+                if not chunk:
+                    break
+                pending.append(
+                    executor.submit(_process_chunk, chunk, as_text,
+                                    cache_options, measure))
+            if not pending:
+                return
+            future: futures.Future = pending.popleft()
+            results, chunk_errors, metrics = future.result()
+            if metrics is not None:
+                instrumentation.merge(*metrics)
+            for package, error in chunk_errors:
+                errors(package, error)
+            yield from results
+
+
+def open_source(path: str) -> TextIO:
+    """Открыть файл с пакетами, `-` означает stdin."""
+    if path == '-':
+        return sys.stdin
+    return open(path, encoding='utf-8')
+
+
+def write_lines(lines: Iterable[str],
+                stream: Optional[TextIO] = None,
+                chunk_lines: int = 4096,
+                on_flush: Optional[Callable[[int], None]] = None
+                ) -> int:
+    """Записать строки в поток крупными блоками, вернуть их число.
+
+    После каждого блока поток сбрасывается и вызывается `on_flush` с
+    числом записанных строк; при `chunk_lines=1` строки выводятся по мере
+    получения, как при построчном `print`. Следующие строки не
+    запрашиваются у `lines`, пока блок не записан.
+    """
+    stream = sys.stdout if stream is None else stream
+    lines = iter(lines)
+    count = 0
+    while True:
+        chunk = list(islice(lines, chunk_lines))
+        if not chunk:
+            return count
+        chunk.append('')
+        stream.write('\n'.join(chunk))
+        stream.flush()
+        count += len(chunk) - 1
+        if on_flush is not None:
+            on_flush(count)
+
+
+def render_messages(messages: Iterable[InfoMessage],
+                    stream: Optional[TextIO] = None,
+                    chunk_lines: int = 4096,
+                    on_flush: Optional[Callable[[int], None]] = None
+                    ) -> int:
+    """Вывести сообщения в поток, вернуть число выведенных сообщений.
+
+    Результат побайтно совпадает с `print(info.get_message())` для каждого
+    сообщения, но строки собираются и пишутся блоками по `chunk_lines`.
+    """
+    lines = (_format_message(info.training_type, info.duration,
+                             info.distance, info.speed, info.calories)
+             for info in messages)
+    return write_lines(lines, stream, chunk_lines, on_flush)
+
+
+class OutputWriter:
+    """Общий вывод сообщений для нескольких потоков-производителей.
+
+    Производители передают объекты `InfoMessage` в ограниченную очередь,
+    а форматирует и пишет их один поток вывода крупными блоками: по
+    накоплении `buffer_lines` строк или раз в `flush_interval` секунд.
+    Порядок внутри одного производителя сохраняется всегда; при
+    `ordered=True` сообщения выводятся строго по номерам `sequence`,
+    которые производители передают вместе с сообщениями.
+    """
+    _STOP = object()
+
+    def __init__(self,
+                 stream: Optional[TextIO] = None,
+                 maxsize: int = 1024,
+                 buffer_lines: int = 4096,
+                 flush_interval: float = 0.5,
+                 ordered: bool = False
+                 ) -> None:
+        import queue
+        import threading
+        self.stream = sys.stdout if stream is None else stream
+        self.buffer_lines = buffer_lines
+        self.flush_interval = flush_interval
+        self.ordered = ordered
+        self.written = 0
+        self._empty = queue.Empty
+        self._queue: queue.Queue = queue.Queue(maxsize)
+        self._pending: List[Tuple[int, List[InfoMessage]]] = []
+        self._next_sequence = 0
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='homework-output')
+        self._thread.start()
+
+    def put(self, info: InfoMessage, sequence: Optional[int] = None) -> None:
+        """Передать одно сообщение на вывод."""
+        self.put_batch([info], sequence)
+
+    def put_batch(self,
+                  messages: Sequence[InfoMessage],
+                  sequence: Optional[int] = None
+                  ) -> None:
+        """Передать пачку сообщений одной операцией с очередью.
+
+        При `ordered=True` `sequence` - номер первого сообщения пачки.
+        """
+        if self._error is not None:
+            raise self._error
+        if self.ordered and sequence is None:
+            raise ValueError('Для упорядоченного вывода нужен sequence')
+        self._queue.put((sequence, list(messages)))
+
+    def _release(self, sequence: int, messages: List[InfoMessage]
+                 ) -> List[InfoMessage]:
+        """Вернуть сообщения, которые можно вывести по порядку номеров."""
+        heapq.heappush(self._pending, (sequence, messages))
+        ready: List[InfoMessage] = []
+        while self._pending and self._pending[0][0] == self._next_sequence:
+            _, batch = heapq.heappop(self._pending)
+            ready.extend(batch)
+            self._next_sequence += len(batch)
+        return ready
+
+    @staticmethod
+    def _format(messages: List[InfoMessage], lines: List[str]) -> None:
+        """Отформатировать сообщения и добавить строки в буфер."""
+        lines.extend(
+            _format_message(info.training_type, info.duration,
+                            info.distance, info.speed, info.calories)
+            for info in messages)
+
+    def _get(self, deadline: float) -> object:
+        """Дождаться элемента очереди не дольше срока сброса буфера."""
+        try:
+            return self._queue.get(
+                timeout=max(deadline - time.monotonic(), 0))
+        except self._empty:
+            return None
+
+    def _run(self) -> None:
+        """Цикл потока вывода."""
+        lines: List[str] = []
+        deadline = time.monotonic() + self.flush_interval
+        try:
+            while True:
+                item = self._get(deadline)
+                if item is self._STOP:
+                    break
+                if item is not None:
+                    sequence, messages = item
+                    if self.ordered:
+                        messages = self._release(sequence, messages)
+                    self._format(messages, lines)
+                if (len(lines) >= self.buffer_lines
+                        or time.monotonic() >= deadline):
+                    self._write(lines)
+                    lines = []
+                    deadline = time.monotonic() + self.flush_interval
+            for _, messages in sorted(self._pending, key=lambda x: x[0]):
+                self._format(messages, lines)
+            self._write(lines)
+        except BaseException as error:
+            self._error = error
+            self._discard()
+
+    def _discard(self) -> None:
+        """После ошибки вывода разбирать очередь до остановки.
+
+        Иначе производители, ожидающие места в заполненной очереди,
+        остались бы заблокированными навсегда; следующий их вызов
+        `put_batch` получит исключение потока вывода.
+        """
+        while self._queue.get() is not self._STOP:
+            pass
+
+    def _write(self, lines: List[str]) -> None:
+        """Записать строки в поток одной операцией."""
+        if lines:
+            lines.append('')
+            self.stream.write('\n'.join(lines))
+            self.stream.flush()
+            self.written += len(lines) - 1
+
+    def close(self) -> None:
+        """Вывести оставшиеся сообщения и остановить поток вывода."""
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self) -> 'OutputWriter':
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+
+COLUMNAR_MAGIC = b'FTRKCOL1'
+COLUMNAR_GROUP = struct.Struct('<IH')
+COLUMNAR_FIELDS = ('duration', 'distance', 'speed', 'calories')
+
+
+class ColumnarWriter:
+    """Потоковая запись результатов в колоночный файл группами строк.
+
+    Каждая группа хранит словарь видов тренировок, однобайтовые коды и
+    колонки float64 `duration`, `distance`, `speed`, `calories`, которые
+    читаются `read_columnar` без разбора строк.
+    """
+
+    def __init__(self, path: str, row_group_size: int = 65536) -> None:
+        self.row_group_size = row_group_size
+        self.rows_written = 0
+        self._buffer: List[InfoMessage] = []
+        self._file: BinaryIO = open(path, 'wb')
+        self._file.write(COLUMNAR_MAGIC)
+
+    def write(self, info: InfoMessage) -> None:
+        """Добавить одно сообщение."""
+        self._buffer.append(info)
+        if len(self._buffer) >= self.row_group_size:
+            self.flush()
+
+    def write_all(self, messages: Iterable[InfoMessage]) -> None:
+        """Добавить все сообщения потока."""
+        for info in messages:
+            self.write(info)
+
+    def write_batch(self, batch: InfoMessageBatch) -> None:
+        """Записать готовый колоночный набор отдельной группой."""
+        self.flush()
+        self._write_group(batch)
+
+    def flush(self) -> None:
+        """Записать накопленные сообщения группой строк."""
+        if self._buffer:
+            self._write_group(InfoMessageBatch.from_messages(self._buffer))
+            self._buffer = []
+
+    def _write_group(self, batch: InfoMessageBatch) -> None:
+        """Записать группу строк в файл."""
+        if not len(batch):
+            return
+        self._file.write(COLUMNAR_GROUP.pack(len(batch),
+                                             len(batch.training_types)))
+        for name in batch.training_types:
+            encoded = name.encode('utf-8')
+            self._file.write(bytes((len(encoded),)) + encoded)
+        self._file.write(batch.type_codes.astype(np.uint8).tobytes())
+        for field in COLUMNAR_FIELDS:
+            self._file.write(getattr(batch, field).astype('<f8').tobytes())
+        self.rows_written += len(batch)
+
+    def close(self) -> None:
+        """Записать остаток и закрыть файл."""
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self) -> 'ColumnarWriter':
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+
+def read_columnar(path: str) -> Iterator[InfoMessageBatch]:
+    """Читать группы строк колоночного файла наборами `InfoMessageBatch`.
+
+    Колонки являются представлениями поверх отображённого в память файла.
+    """
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size <= len(COLUMNAR_MAGIC):
+            return
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[:len(COLUMNAR_MAGIC)] != COLUMNAR_MAGIC:
+        raise ValueError('Файл не является колоночным файлом результатов')
+    offset = len(COLUMNAR_MAGIC)
+    while offset < len(mapped):
+        rows, type_count = COLUMNAR_GROUP.unpack_from(mapped, offset)
+        offset += COLUMNAR_GROUP.size
+        names = []
+        for _ in range(type_count):
+            length = mapped[offset]
+            names.append(mapped[offset + 1:offset + 1 + length].decode())
+            offset += 1 + length
+        codes = np.frombuffer(mapped, np.uint8, rows, offset)
+        offset += rows
+        columns = []
+        for _ in COLUMNAR_FIELDS:
+            columns.append(np.frombuffer(mapped, '<f8', rows, offset))
+            offset += rows * 8
+        yield InfoMessageBatch.from_codes(names, codes, *columns)
+
+
+class Aggregate:
+    """Накопленные показатели тренировок одного вида."""
+    __slots__ = ('count', 'duration', 'distance', 'calories',
+                 'speed_time', 'min_speed', 'max_speed',
+                 'min_calories', 'max_calories')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.duration = 0.0
+        self.distance = 0.0
+        self.calories = 0.0
+        self.speed_time = 0.0
+        self.min_speed = float('inf')
+        self.max_speed = float('-inf')
+        self.min_calories = float('inf')
+        self.max_calories = float('-inf')
+
+    def add(self, info: InfoMessage) -> None:
+        """Учесть одно информационное сообщение."""
+        self.count += 1
+        self.duration += info.duration
+        self.distance += info.distance
+        self.calories += info.calories
+        self.speed_time += info.speed * info.duration
+        self.min_speed = min(self.min_speed, info.speed)
+        self.max_speed = max(self.max_speed, info.speed)
+        self.min_calories = min(self.min_calories, info.calories)
+        self.max_calories = max(self.max_calories, info.calories)
+
+    def merge(self, other: 'Aggregate') -> None:
+        """Добавить показатели другого агрегата."""
+        self.count += other.count
+        self.duration += other.duration
+        self.distance += other.distance
+        self.calories += other.calories
+        self.speed_time += other.speed_time
+        self.min_speed = min(self.min_speed, other.min_speed)
+        self.max_speed = max(self.max_speed, other.max_speed)
+        self.min_calories = min(self.min_calories, other.min_calories)
+        self.max_calories = max(self.max_calories, other.max_calories)
+
+    @property
+    def mean_speed(self) -> float:
+        """Средняя скорость, взвешенная по длительности тренировок."""
+        return self.speed_time / self.duration if self.duration else 0.0
+
+    def to_list(self) -> list:
+        """Вернуть значения полей для сохранения."""
+        return [getattr(self, name) for name in self.__slots__]
+
+    @classmethod
+    def from_list(cls, values: Sequence[float]) -> 'Aggregate':
+        """Восстановить агрегат из значений полей."""
+        aggregate = cls()
+        for name, value in zip(cls.__slots__, values):
+            setattr(aggregate, name, value)
+        return aggregate
+
+
+class Aggregator:
+    """Нарастающие итоги по пользователям и видам тренировок.
+
+    Каждое сообщение учитывается за O(1); частичные итоги параллельных
+    обработчиков объединяются `merge`, контрольные точки сохраняются в JSON.
+    """
+
+    def __init__(self) -> None:
+        self.totals: Dict[Tuple[str, str], Aggregate] = {}
+
+    def add(self, user: str, info: InfoMessage) -> None:
+        """Учесть сообщение о тренировке пользователя."""
+        key = (user, info.training_type)
+        aggregate = self.totals.get(key)
+        if aggregate is None:
+            aggregate = self.totals[key] = Aggregate()
+        aggregate.add(info)
+
+    def merge(self, other: 'Aggregator') -> None:
+        """Добавить итоги другого агрегатора."""
+        for key, aggregate in other.totals.items():
+            if key in self.totals:
+                self.totals[key].merge(aggregate)
+            else:
+                self.totals[key] = Aggregate.from_list(aggregate.to_list())
+
+    def get(self, user: str, training_type: str) -> Optional[Aggregate]:
+        """Вернуть итоги пользователя по виду тренировки."""
+        return self.totals.get((user, training_type))
+
+    def save(self, path: str, temporary: Optional[str] = None) -> None:
+        """Атомарно сохранить контрольную точку в файл.
+
+        Данные пишутся во временный файл `temporary` (по умолчанию
+        `{path}.tmp`) и переименовываются в `path`.
+        """
+        rows = [[user, training_type, *aggregate.to_list()]
+                for (user, training_type), aggregate in self.totals.items()]
+        if temporary is None:
+            temporary = f'{path}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(rows, file)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'Aggregator':
+        """Загрузить контрольную точку из файла."""
+        aggregator = cls()
+        with open(path, encoding='utf-8') as file:
+            for user, training_type, *values in json.load(file):
+                aggregator.totals[(user, training_type)] = (
+                    Aggregate.from_list(values))
+        return aggregator
+
+
+class QuantileSketch:
+    """Потоковая оценка квантилей (KLL-скетч).
+
+    Хранит O(k) значений независимо от длины потока; ошибка ранга
+    порядка 1.7 / k. Скетчи объединяются `merge` и сохраняются в байты.
+    """
+    __slots__ = ('k', 'count', 'min', 'max', 'levels', '_coin')
+    HEADER = struct.Struct('<HQddH')
+
+    def __init__(self, k: int = 200) -> None:
+        self.k = k
+        self.count = 0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self.levels: List[List[float]] = [[]]
+        self._coin = 0
+
+    def _capacity(self, level: int) -> int:
+        """Вместимость уровня: нижние уровни меньше верхних."""
+        depth = len(self.levels) - level - 1
+        return max(int(self.k * (2 / 3) ** depth), 2)
+
+    def add(self, value: float) -> None:
+        """Учесть одно значение."""
+        self.count += 1
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        level = self.levels[0]
+        level.append(value)
+        if len(level) >= self._capacity(0):
+            self._compress()
+
+    def _compress(self) -> None:
+        """Сжать переполненные уровни, перенося половину значений выше."""
+        for level, items in enumerate(self.levels):
+            if len(items) < self._capacity(level):
+                continue
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+            items.sort()
+            rest = [items.pop()] if len(items) % 2 else []
+            self._coin ^= 1
+            self.levels[level + 1].extend(items[self._coin::2])
+            items[:] = rest
+
+    def quantile(self, q: float) -> float:
+        """Оценить квантиль уровня q из [0, 1]."""
+        if not self.count:
+            return float('nan')
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        weighted = sorted((value, 1 << level)
+                          for level, items in enumerate(self.levels)
+                          for value in items)
+        target = q * self.count
+        total = 0
+        for value, weight in weighted:
+            total += weight
+            if total >= target:
+                return value
+        return self.max
+
+    def merge(self, other: 'QuantileSketch') -> None:
+        """Добавить значения другого скетча."""
+        if other.k != self.k:
+            raise ValueError('Нельзя объединить скетчи с разным k')
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for items, others in zip(self.levels, other.levels):
+            items.extend(others)
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+
+    def to_bytes(self) -> bytes:
+        """Сохранить скетч в компактное двоичное представление."""
+        parts = [self.HEADER.pack(self.k, self.count, self.min, self.max,
+                                  len(self.levels))]
+        for items in self.levels:
+            parts.append(struct.pack(f'<I{len(items)}d', len(items), *items))
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'QuantileSketch':
+        """Восстановить скетч из двоичного представления."""
+        k, count, low, high, depth = cls.HEADER.unpack_from(data)
+        sketch = cls(k)
+        sketch.count, sketch.min, sketch.max = count, low, high
+        sketch.levels = []
+        offset = cls.HEADER.size
+        for _ in range(depth):
+            size, = struct.unpack_from('<I', data, offset)
+            sketch.levels.append(
+                list(struct.unpack_from(f'<{size}d', data, offset + 4)))
+            offset += 4 + size * 8
+        return sketch
+
+
+class DistinctCounter:
+    """Оценка числа различных ключей (HyperLogLog).
+
+    Занимает 2 ** precision байт; относительная ошибка около
+    1.04 / sqrt(2 ** precision), при precision=12 - примерно 1.6 %.
+    """
+    __slots__ = ('precision', 'registers')
+
+    def __init__(self, precision: int = 12) -> None:
+        if not 4 <= precision <= 16:
+            raise ValueError('Точность должна быть от 4 до 16')
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, key: str) -> None:
+        """Учесть ключ, например идентификатор устройства."""
+        value = int.from_bytes(hashlib.blake2b(
+            key.encode(), digest_size=8).digest(), 'little')
+        bits = 64 - self.precision
+        index = value >> bits
+        rank = bits - (value & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self) -> float:
+        """Оценить число различных ключей."""
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / sum(
+            2.0 ** -rank for rank in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * size and zeros:
+            estimate = size * math.log(size / zeros)
+        return estimate
+
+    def merge(self, other: 'DistinctCounter') -> None:
+        """Добавить ключи другого счётчика."""
+        if other.precision != self.precision:
+            raise ValueError('Нельзя объединить счётчики с разной точностью')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def to_bytes(self) -> bytes:
+        """Сохранить счётчик в двоичное представление."""
+        return bytes((self.precision,)) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'DistinctCounter':
+        """Восстановить счётчик из двоичного представления."""
+        counter = cls(data[0])
+        counter.registers[:] = data[1:]
+        return counter
+
+
+def _pack_blob(data: bytes) -> bytes:
+    """Добавить к блоку данных его длину."""
+    return struct.pack('<I', len(data)) + data
+
+
+def _unpack_blob(data: bytes, offset: int) -> Tuple[bytes, int]:
+    """Прочитать блок данных с длиной и вернуть смещение за ним."""
+    size, = struct.unpack_from('<I', data, offset)
+    offset += 4
+    return data[offset:offset + size], offset + size
+
+
+class StreamStats:
+    """Приближённая статистика потока результатов.
+
+    Квантили скорости и калорий по видам тренировок и число различных
+    устройств при постоянном объёме памяти; частичная статистика
+    параллельных обработчиков объединяется `merge`.
+    """
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, k: int = 200, precision: int = 12) -> None:
+        self.k = k
+        self.speed: Dict[str, QuantileSketch] = {}
+        self.calories: Dict[str, QuantileSketch] = {}
+        self.devices = DistinctCounter(precision)
+
+    def add(self, info: InfoMessage, device: Optional[str] = None) -> None:
+        """Учесть сообщение и, если известно, устройство-источник."""
+        training_type = info.training_type
+        if training_type not in self.speed:
+            self.speed[training_type] = QuantileSketch(self.k)
+            self.calories[training_type] = QuantileSketch(self.k)
+        self.speed[training_type].add(info.speed)
+        self.calories[training_type].add(info.calories)
+        if device is not None:
+            self.devices.add(device)
+
+    def track(self,
+              messages: Iterable[Union[InfoMessage,
+                                       Tuple[Optional[str], InfoMessage]]]
+              ) -> Iterator[InfoMessage]:
+        """Пропустить поток сообщений, попутно собирая статистику.
+
+        Элементами могут быть сообщения или пары `(device, info)`, как у
+        `process_device_stream`; в обоих случаях возвращаются сообщения.
+        """
+        add = self.add
+        for item in messages:
+            if isinstance(item, tuple):
+                device, info = item
+                add(info, device)
+                yield info
+            else:
+                add(item)
+                yield item
+
+    def summary(self) -> Dict[str, Dict[str, List[float]]]:
+        """Вернуть квантили QUANTILES по видам тренировок."""
+        return {training_type: {
+            'speed': [self.speed[training_type].quantile(q)
+                      for q in self.QUANTILES],
+            'calories': [self.calories[training_type].quantile(q)
+                         for q in self.QUANTILES],
+        } for training_type in self.speed}
+
+    def merge(self, other: 'StreamStats') -> None:
+        """Добавить статистику другого обработчика."""
+        for training_type, sketch in other.speed.items():
+            if training_type in self.speed:
+                self.speed[training_type].merge(sketch)
+                self.calories[training_type].merge(
+                    other.calories[training_type])
+            else:
+                self.speed[training_type] = QuantileSketch.from_bytes(
+                    sketch.to_bytes())
+                self.calories[training_type] = QuantileSketch.from_bytes(
+                    other.calories[training_type].to_bytes())
+        self.devices.merge(other.devices)
+
+    def to_bytes(self) -> bytes:
+        """Сохранить статистику в компактное двоичное представление."""
+        parts = [struct.pack('<HI', self.k, len(self.speed))]
+        for training_type, sketch in self.speed.items():
+            parts.append(_pack_blob(training_type.encode()))
+            parts.append(_pack_blob(sketch.to_bytes()))
+            parts.append(_pack_blob(self.calories[training_type].to_bytes()))
+        parts.append(self.devices.to_bytes())
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'StreamStats':
+        """Восстановить статистику из двоичного представления."""
+        k, types = struct.unpack_from('<HI', data)
+        offset = 6
+        stats = cls(k)
+        for _ in range(types):
+            name, offset = _unpack_blob(data, offset)
+            speed, offset = _unpack_blob(data, offset)
+            calories, offset = _unpack_blob(data, offset)
+            stats.speed[name.decode()] = QuantileSketch.from_bytes(speed)
+            stats.calories[name.decode()] = QuantileSketch.from_bytes(
+                calories)
+        stats.devices = DistinctCounter.from_bytes(data[offset:])
+        return stats
+
+
+ALL_USERS = '*'
+SHARD_DIRS = ('pending', 'running', 'done', 'failed', 'attempts')
+
+
+def _shard_path(workdir: str, folder: str, name: str) -> str:
+    """Вернуть путь к файлу в подкаталоге рабочего каталога."""
+    return os.path.join(workdir, folder, name)
+
+
+def split_archive(source: Iterable,
+                  workdir: str,
+                  shard_size: int = 100000
+                  ) -> int:
+    """Разбить архив пакетов на части в рабочем каталоге.
+
+    Части записываются в `pending/`, описание - последним в
+    `manifest.json`; повторный вызов после него ничего не делает, а
+    после сбоя до него разбиение выполняется заново.
+    """
+    manifest = os.path.join(workdir, 'manifest.json')
+    if os.path.exists(manifest):
+        with open(manifest, encoding='utf-8') as file:
+            return json.load(file)['shards']
+    for folder in SHARD_DIRS:
+        os.makedirs(os.path.join(workdir, folder), exist_ok=True)
+    for name in os.listdir(os.path.join(workdir, 'pending')):
+        os.remove(_shard_path(workdir, 'pending', name))
+    source = iter(source)
+    shards = 0
+    while True:
+        chunk = list(islice(source, shard_size))
+        if not chunk:
+            break
+        path = _shard_path(workdir, 'pending', f'shard-{shards:05d}.jsonl')
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as file:
+            for raw in chunk:
+                line = (raw.rstrip('\n') if isinstance(raw, str)
+                        else json.dumps(list(raw)))
+                file.write(line + '\n')
+        os.replace(f'{path}.tmp', path)
+        shards += 1
+    with open(f'{manifest}.tmp', 'w', encoding='utf-8') as file:
+        json.dump({'shards': shards, 'shard_size': shard_size}, file)
+    os.replace(f'{manifest}.tmp', manifest)
+    return shards
+
+
+def _requeue(workdir: str, shard: str, running: str,
+             max_attempts: int) -> None:
+    """Вернуть часть в очередь или отметить её как неудавшуюся."""
+    counter = _shard_path(workdir, 'attempts', shard)
+    attempts = 1
+    if os.path.exists(counter):
+        with open(counter, encoding='utf-8') as file:
+            attempts += int(file.read() or 0)
+    with open(counter, 'w', encoding='utf-8') as file:
+        file.write(str(attempts))
+    folder = 'failed' if attempts >= max_attempts else 'pending'
+    try:
+        os.replace(running, _shard_path(workdir, folder, f'{shard}.jsonl'))
+    except FileNotFoundError:
+        pass
+
+
+def _is_done(workdir: str, shard: str) -> bool:
+    """Проверить, обработана ли часть."""
+    return os.path.exists(_shard_path(workdir, 'done', f'{shard}.json'))
+
+
+def _claim_shard(workdir: str, worker_id: str
+                 ) -> Optional[Tuple[str, str]]:
+    """Атомарно забрать следующую часть из очереди."""
+    for name in sorted(os.listdir(os.path.join(workdir, 'pending'))):
+        if not name.endswith('.jsonl'):
+            continue
+        shard = name[:-len('.jsonl')]
+        pending = _shard_path(workdir, 'pending', name)
+        if _is_done(workdir, shard):
+            try:
+                os.remove(pending)
+            except FileNotFoundError:
+                pass
+            continue
+        running = _shard_path(workdir, 'running', f'{shard}.{worker_id}')
+        try:
+            os.rename(pending, running)
+        except FileNotFoundError:
+            continue
+        return shard, running
+    return None
+
+
+def _process_shard(workdir: str, shard: str, running: str,
+                   worker_id: str) -> None:
+    """Обработать часть: вывод, итоги и отметка о завершении.
+
+    Временные файлы содержат `worker_id`, поэтому обработчики, получившие
+    одну часть после возврата в очередь, не пишут в общий файл.
+    """
+    aggregator = Aggregator()
+    errors = []
+
+    def tee(messages: Iterable[InfoMessage]) -> Iterator[InfoMessage]:
+        for count, info in enumerate(messages, 1):
+            aggregator.add(ALL_USERS, info)
+            if not count % 10000:
+                os.utime(running)
+            yield info
+
+    suffix = f'.{worker_id}.tmp'
+    output = _shard_path(workdir, 'done', f'{shard}.out')
+    with open(running, encoding='utf-8') as source, \
+            open(output + suffix, 'w', encoding='utf-8') as file:
+        render_messages(tee(process_stream(
+            source, lambda package, error: errors.append(str(error)))), file)
+    os.replace(output + suffix, output)
+    aggregate = _shard_path(workdir, 'done', f'{shard}.agg.json')
+    aggregator.save(aggregate, aggregate + suffix)
+    marker = _shard_path(workdir, 'done', f'{shard}.json')
+    with open(marker + suffix, 'w', encoding='utf-8') as file:
+        json.dump({'errors': errors}, file, ensure_ascii=False)
+    os.replace(marker + suffix, marker)
+    try:
+        os.remove(running)
+    except FileNotFoundError:
+        pass
+
+
+def run_worker(workdir: str,
+               worker_id: Optional[str] = None,
+               max_attempts: int = 3
+               ) -> int:
+    """Обрабатывать части из рабочего каталога, пока очередь не опустеет.
+
+    Рабочий каталог может быть общим для нескольких хостов; часть
+    забирается переименованием файла, поэтому её получает один обработчик.
+    `worker_id` должен быть уникальным, по умолчанию `hostname-pid`.
+    Возвращает число обработанных частей.
+    """
+    if worker_id is None:
+        worker_id = _local_worker_id(os.getpid())
+    processed = 0
+    while True:
+        claimed = _claim_shard(workdir, worker_id)
+        if claimed is None:
+            return processed
+        shard, running = claimed
+        try:
+            _process_shard(workdir, shard, running, worker_id)
+        except Exception as error:
+            print(f'Ошибка обработки части {shard}: {error!r}',
+                  file=sys.stderr)
+            _requeue(workdir, shard, running, max_attempts)
+            continue
+        processed += 1
+
+
+def _local_worker_id(pid: int) -> str:
+    """Вернуть идентификатор обработчика этого хоста по умолчанию."""
+    import socket
+    return f'{socket.gethostname()}-{pid}'
+
+
+def _is_alive(pid: int) -> bool:
+    """Проверить, существует ли процесс; вне POSIX считается живым."""
+    if os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _recover(workdir: str,
+             abandoned: Callable[[str, str], bool],
+             max_attempts: int
+             ) -> int:
+    """Вернуть в очередь брошенные части из `running/`.
+
+    `abandoned(running, worker_id)` решает, брошена ли часть; файлы уже
+    обработанных частей просто удаляются.
+    """
+    recovered = 0
+    for name in os.listdir(os.path.join(workdir, 'running')):
+        shard, _, worker_id = name.partition('.')
+        running = _shard_path(workdir, 'running', name)
+        try:
+            if _is_done(workdir, shard):
+                os.remove(running)
+            elif abandoned(running, worker_id):
+                _requeue(workdir, shard, running, max_attempts)
+                recovered += 1
+        except FileNotFoundError:
+            continue
+    return recovered
+
+
+def recover_stale(workdir: str, timeout: float, max_attempts: int = 3
+                  ) -> int:
+    """Вернуть в очередь части, которые обрабатываются дольше `timeout`."""
+    now = time.time()
+    return _recover(
+        workdir,
+        lambda running, worker_id: (
+            now - os.path.getmtime(running) > timeout),
+        max_attempts)
+
+
+def recover_dead(workdir: str, max_attempts: int = 3) -> int:
+    """Вернуть в очередь части завершившихся процессов этого хоста.
+
+    Учитываются только обработчики с идентификатором по умолчанию
+    `hostname-pid`, у которых совпадает имя хоста, а процесса `pid`
+    больше нет; части других хостов ждут `recover_stale`.
+    """
+    def abandoned(running: str, worker_id: str) -> bool:
+        _, _, pid = worker_id.rpartition('-')
+        return (pid.isdigit()
+                and worker_id == _local_worker_id(int(pid))
+                and not _is_alive(int(pid)))
+
+    return _recover(workdir, abandoned, max_attempts)
+
+
+def _shard_names(workdir: str, folder: str, suffix: str) -> List[str]:
+    """Вернуть отсортированные имена частей в подкаталоге."""
+    return sorted(name[:-len(suffix)]
+                  for name in os.listdir(os.path.join(workdir, folder))
+                  if name.endswith(suffix)
+                  and not name.endswith('.agg' + suffix))
+
+
+def collect(workdir: str) -> Aggregator:
+    """Объединить итоги всех обработанных частей."""
+    aggregator = Aggregator()
+    for shard in _shard_names(workdir, 'done', '.json'):
+        aggregator.merge(Aggregator.load(
+            _shard_path(workdir, 'done', f'{shard}.agg.json')))
+    return aggregator
+
+
+def iter_shard_output(workdir: str) -> Iterator[str]:
+    """Лениво вернуть строки вывода частей в исходном порядке."""
+    for shard in _shard_names(workdir, 'done', '.json'):
+        with open(_shard_path(workdir, 'done', f'{shard}.out'),
+                  encoding='utf-8') as file:
+            for line in file:
+                yield line.rstrip('\n')
+
+
+def coordinate(source: Iterable,
+               workdir: str,
+               workers: Optional[int] = None,
+               shard_size: int = 100000,
+               timeout: float = 600.0,
+               max_attempts: int = 3,
+               poll_interval: float = 0.2
+               ) -> Aggregator:
+    """Обработать архив частями локальными и внешними обработчиками.
+
+    Координатор разбивает архив, запускает `workers` локальных процессов
+    `run_worker` (0 - только внешние обработчики с тем же каталогом),
+    возвращает в очередь зависшие части и объединяет итоги. Повторный
+    запуск после сбоя продолжает с уже обработанных частей; части
+    завершившихся локальных процессов возвращаются в очередь сразу, без
+    ожидания `timeout`.
+    """
+    import multiprocessing
+    total = split_archive(source, workdir, shard_size)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    processes: List[multiprocessing.Process] = []
+    while True:
+        finished = (len(_shard_names(workdir, 'done', '.json'))
+                    + len(_shard_names(workdir, 'failed', '.jsonl')))
+        if finished >= total:
+            break
+        recover_dead(workdir, max_attempts)
+        recover_stale(workdir, timeout, max_attempts)
+        processes = [process for process in processes if process.is_alive()]
+        if os.listdir(os.path.join(workdir, 'pending')):
+            while len(processes) < workers:
+                process = multiprocessing.Process(
+                    target=run_worker, args=(workdir, None, max_attempts))
+                process.start()
+                processes.append(process)
+        time.sleep(poll_interval)
+    for process in processes:
+        process.join()
+    for shard in _shard_names(workdir, 'failed', '.jsonl'):
+        print(f'Часть {shard} не обработана за {max_attempts} попыток',
+              file=sys.stderr)
+    return collect(workdir)
+
+
+class LatencyStats:
+    """Задержки обработки пакетов по последним `maxlen` замерам."""
+
+    def __init__(self, maxlen: int = 100000) -> None:
+        self.samples: deque = deque(maxlen=maxlen)
+        self.count = 0
+
+    def add(self, seconds: float) -> None:
+        """Добавить замер задержки."""
+        self.samples.append(seconds)
+        self.count += 1
+
+    def percentile(self, percent: float) -> float:
+        """Вернуть перцентиль задержки в секундах."""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1,
+                           int(len(ordered) * percent / 100))]
+
+    def summary(self) -> Dict[str, float]:
+        """Вернуть число пакетов и задержки p50/p99 в миллисекундах."""
+        return {'count': self.count,
+                'p50_ms': self.percentile(50) * 1000,
+                'p99_ms': self.percentile(99) * 1000}
+
+
+class PacketServer:
+    """Асинхронный сервер пакетов в формате JSON lines.
+
+    На каждую строку-пакет сервер отвечает строкой JSON `{"message": ...}`
+    или `{"error": ...}` в том же порядке. Очередь соединения ограничена
+    `queue_size`, поэтому при её заполнении чтение из сокета
+    приостанавливается. Накопившиеся пакеты обрабатываются пачками до
+    `batch_size` и отправляются одной записью.
+    """
+
+    def __init__(self,
+                 batch_size: int = 256,
+                 queue_size: int = 1024,
+                 cache: Optional[ResultCache] = None
+                 ) -> None:
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.cache = cache
+        self.latency = LatencyStats()
+        self.connections = 0
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0
+                    ) -> asyncio.AbstractServer:
+        """Запустить сервер, `port=0` выбирает свободный порт."""
+        return await asyncio.start_server(self._handle, host, port)
+
+    async def _handle(self,
+                      reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter
+                      ) -> None:
+        """Принимать пакеты соединения и передавать их на обработку.
+
+        Если отправка ответов прервалась, чтение прекращается: иначе оно
+        могло бы навсегда остановиться на заполненной очереди.
+        """
+        self.connections += 1
+        queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        receiver = asyncio.ensure_future(self._receive(reader, queue))
+        responder = asyncio.ensure_future(self._respond(queue, writer))
+        try:
+            await asyncio.wait((receiver, responder),
+                               return_when=asyncio.FIRST_COMPLETED)
+            if responder.done():
+                receiver.cancel()
+            await responder
+        finally:
+            receiver.cancel()
+            responder.cancel()
+            self.connections -= 1
+            writer.close()
+
+    async def _receive(self,
+                       reader: asyncio.StreamReader,
+                       queue: asyncio.Queue
+                       ) -> None:
+        """Читать пакеты в очередь, в конце передать `None`."""
+        try:
+            async for line in reader:
+                await queue.put((time.perf_counter(), line))
+        except ConnectionError:
+            pass
+        await queue.put(None)
+
+    async def _respond(self,
+                       queue: asyncio.Queue,
+                       writer: asyncio.StreamWriter
+                       ) -> None:
+        """Обрабатывать пакеты пачками и отправлять ответы."""
+        finished = False
+        while not finished:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            if batch[-1] is None:
+                finished = True
+                batch.pop()
+            if not batch:
+                continue
+            writer.write(''.join(
+                self.answer(line) for _, line in batch).encode('utf-8'))
+            try:
+                await writer.drain()
+            except ConnectionError:
+                return
+            now = time.perf_counter()
+            for received, _ in batch:
+                self.latency.add(now - received)
+
+    def answer(self, line: bytes) -> str:
+        """Вернуть строку ответа на один пакет."""
+        try:
+            workout_type_def, data_def = parse_package(line.decode('utf-8'))
+            problem = check_package(workout_type_def, data_def)
+            if problem is not None:
+                raise ValueError(problem)
+            if self.cache is not None:
+                info = self.cache.get(workout_type_def, data_def)
+            else:
+                info = read_package(workout_type_def, data_def
+                                    ).show_training_info()
+        except PACKAGE_ERRORS as error:
+            response = {'error': str(error)}
+        else:
+            response = {'message': info.get_message()}
+        return json.dumps(response, ensure_ascii=False) + '\n'
+
+
+async def serve(host: str, port: int, report_interval: float = 10.0,
+                **options: object) -> None:
+    """Обслуживать пакеты, периодически сообщая задержки в stderr."""
+    packet_server = PacketServer(**options)
+    server = await packet_server.start(host, port)
+    async with server:
+        while True:
+            await asyncio.sleep(report_interval)
+            print(json.dumps(packet_server.latency.summary()),
+                  file=sys.stderr)
+
+
+async def run_load(host: str,
+                   port: int,
+                   packages: Sequence[Package] = DEMO_PACKAGES,
+                   connections: int = 10,
+                   repeat: int = 100
+                   ) -> LatencyStats:
+    """Нагрузить сервер с `connections` соединений и замерить задержки."""
+    stats = LatencyStats()
+
+    async def client() -> None:
+        reader, writer = await asyncio.open_connection(host, port)
+        sent: deque = deque()
+
+        async def send() -> None:
+            for _ in range(repeat):
+                for package in packages:
+                    sent.append(time.perf_counter())
+                    writer.write(json.dumps(package).encode('utf-8') + b'\n')
+                    await writer.drain()
+
+        sender = asyncio.ensure_future(send())
+        for _ in range(repeat * len(packages)):
+            await reader.readline()
+            stats.add(time.perf_counter() - sent.popleft())
+        await sender
+        writer.close()
+
+    await asyncio.gather(*(client() for _ in range(connections)))
+    return stats
+
+
+class Instrumentation:
+    """Счётчики и гистограммы времени основных этапов обработки.
+
+    В выключенном состоянии функции и методы модуля не обёрнуты, поэтому
+    накладных расходов нет. `enable` оборачивает `read_package`, формулы
+    дистанции, скорости и калорий зарегистрированных тренировок,
+    `Training.show_training_info` и форматирование сообщений (замер
+    `get_message` учитывает и блочный вывод `render_messages`); плагины,
+    загруженные позже, не учитываются. Число вызовов формул показывает,
+    сколько раз каждый показатель рассчитывается на пакет.
+    """
+    FORMULAS = ('get_distance', 'get_mean_speed', 'get_spent_calories')
+    BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 1e-3, 1e-2,
+               float('inf'))
+
+    def __init__(self) -> None:
+        self.histograms: Dict[str, List[int]] = {}
+        self.sums: Counter = Counter()
+        self._originals: List[Tuple[object, str, object]] = []
+
+    @property
+    def enabled(self) -> bool:
+        """Включено ли измерение."""
+        return bool(self._originals)
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Учесть один вызов длительностью `seconds`."""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = [0] * len(self.BUCKETS)
+        for index, bound in enumerate(self.BUCKETS):
+            if seconds <= bound:
+                histogram[index] += 1
+                break
+        self.sums[name] += seconds
+
+    def _wrap(self, owner: object, attribute: str, name: str) -> None:
+        """Заменить функцию владельца на замеряющую обёртку."""
+        original = getattr(owner, attribute)
+        observe = self.observe
+        clock = time.perf_counter
+
+        @wraps(original)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                observe(name, clock() - start)
+
+        self._originals.append((owner, attribute, original))
+        setattr(owner, attribute, wrapper)
+
+    def enable(self) -> None:
+        """Начать измерение."""
+        if self.enabled:
+            return
+        self._wrap(sys.modules[__name__], 'read_package', 'read_package')
+        for training_class in {Training, *TRAINING_TYPES.values()}:
+            for formula in self.FORMULAS:
+                if formula in vars(training_class):
+                    self._wrap(training_class, formula,
+                               f'{training_class.__name__}.{formula}')
+        self._wrap(Training, 'show_training_info', 'show_training_info')
+        self._wrap(sys.modules[__name__], '_format_message', 'get_message')
+
+    def disable(self) -> None:
+        """Прекратить измерение и вернуть исходные функции."""
+        while self._originals:
+            owner, attribute, original = self._originals.pop()
+            setattr(owner, attribute, original)
+
+    def reset(self) -> None:
+        """Обнулить накопленные значения."""
+        self.histograms.clear()
+        self.sums.clear()
+
+    def snapshot(self) -> Tuple[Dict[str, List[int]], Dict[str, float]]:
+        """Вернуть копию накопленных значений для передачи между процессами."""
+        return ({name: list(histogram)
+                 for name, histogram in self.histograms.items()},
+                dict(self.sums))
+
+    def merge(self,
+              histograms: Dict[str, List[int]],
+              sums: Dict[str, float]
+              ) -> None:
+        """Добавить значения, накопленные в другом процессе."""
+        for name, histogram in histograms.items():
+            own = self.histograms.setdefault(name, [0] * len(self.BUCKETS))
+            for index, count in enumerate(histogram):
+                own[index] += count
+        self.sums.update(sums)
+
+    def to_dict(self) -> Dict[str, Dict]:
+        """Вернуть накопленные значения в виде словаря."""
+        return {name: {'count': sum(histogram),
+                       'sum_seconds': self.sums[name],
+                       'buckets': dict(zip(map(str, self.BUCKETS),
+                                           histogram))}
+                for name, histogram in sorted(self.histograms.items())}
+
+    def to_prometheus(self) -> str:
+        """Вернуть накопленные значения в текстовом формате Prometheus."""
+        metric = 'fitness_tracker_call_duration_seconds'
+        lines = [f'# TYPE {metric} histogram']
+        for name, histogram in sorted(self.histograms.items()):
+            total = 0
+            for bound, count in zip(self.BUCKETS, histogram):
+                total += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{metric}_bucket{{operation="{name}",'
+                             f'le="{le}"}} {total}')
+            lines.append(f'{metric}_sum{{operation="{name}"}} '
+                         f'{self.sums[name]!r}')
+            lines.append(f'{metric}_count{{operation="{name}"}} {total}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path: str) -> None:
+        """Сохранить значения в файл: JSON для `.json`, иначе Prometheus."""
+        if path.endswith('.json'):
+            text = json.dumps(self.to_dict(), indent=2)
+        else:
+            text = self.to_prometheus()
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            file.write(text)
+        os.replace(temporary, path)
+
+
+instrumentation = Instrumentation()
+
+
+def profile_stream(results: Iterable, limit: int, path: str) -> Iterator:
+    """Профилировать получение первых `limit` результатов через cProfile.
+
+    Профилируется только работа внутри `results`, статистика сохраняется
+    в `path` для `pstats`, после чего поток продолжается без профилирования.
+    """
+    iterator = iter(results)
+    profiler = cProfile.Profile()
+    try:
+        for _ in range(limit):
+            profiler.enable()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                profiler.disable()
+            yield item
+    finally:
+        profiler.dump_stats(path)
+    yield from iterator
+
+
+def startup_profile(limit: int = 10) -> Dict[str, object]:
+    """Замерить холодный импорт модуля в отдельном интерпретаторе.
+
+    Возвращает время запуска процесса в секундах, время импорта модуля
+    по `-X importtime` в микросекундах и `limit` самых долгих импортов.
+    """
+    import subprocess
+    module = os.path.splitext(os.path.basename(__file__))[0]
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=True)
+    wall_seconds = time.perf_counter() - start
+    imports = []
+    for line in completed.stderr.splitlines():
+        _, _, fields = line.partition(':')
+        _, cumulative, name = fields.split('|')
+        if cumulative.strip().isdigit():
+            imports.append((int(cumulative), name.strip()))
+    own = [cumulative for cumulative, name in imports if name == module]
+    return {'wall_seconds': wall_seconds,
+            'import_us': own[0] if own else 0,
+            'top': sorted(imports, reverse=True)[:limit]}
 
 
 def main(training_def: Training) -> None:
@@ -151,13 +2726,210 @@ def main(training_def: Training) -> None:
     print(info_text)
 
 
+def cli(argv: Optional[Sequence[str]] = None) -> None:
+    """Обработать пакеты из файла или stdin и вывести результат."""
+    parser = argparse.ArgumentParser(description=cli.__doc__)
+    parser.add_argument('source', nargs='?',
+                        help='файл с пакетами CSV/JSON lines, `-` для stdin')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='число процессов, 0 - по числу ядер')
+    parser.add_argument('--chunk-size', type=int, default=10000,
+                        help='число пакетов в части для процесса')
+    parser.add_argument('--cache-size', type=int, default=0,
+                        help='размер кэша результатов, 0 - без кэша')
+    parser.add_argument('--cache-ttl', type=float,
+                        help='время жизни записи кэша в секундах')
+    parser.add_argument('--cache-file',
+                        help='общий файл кэша SQLite для процессов')
+    parser.add_argument('--binary', action='store_true',
+                        help='читать пакеты из бинарного архива')
+    parser.add_argument('--serve', metavar='HOST:PORT',
+                        help='принимать пакеты JSON lines по TCP')
+    parser.add_argument('--load', metavar='HOST:PORT',
+                        help='нагрузить сервер демонстрационными пакетами')
+    parser.add_argument('--connections', type=int, default=10,
+                        help='число соединений для --load')
+    parser.add_argument('--metrics',
+                        default=os.environ.get('FITNESS_TRACKER_METRICS'),
+                        help='сохранить замеры этапов в файл .json или '
+                             'Prometheus (FITNESS_TRACKER_METRICS)')
+    parser.add_argument('--profile', type=int, metavar='N',
+                        default=os.environ.get('FITNESS_TRACKER_PROFILE'),
+                        help='профилировать первые N пакетов '
+                             '(FITNESS_TRACKER_PROFILE)')
+    parser.add_argument('--profile-output', default='homework.prof',
+                        help='файл статистики cProfile')
+    parser.add_argument('--shard', metavar='DIR',
+                        help='координировать обработку частями в каталоге')
+    parser.add_argument('--worker', metavar='DIR',
+                        help='обрабатывать части из общего каталога')
+    parser.add_argument('--shard-size', type=int, default=100000,
+                        help='число пакетов в части для --shard')
+    parser.add_argument('--startup-profile', action='store_true',
+                        help='замерить время запуска и импорта модуля')
+    parser.add_argument('--columnar', metavar='PATH',
+                        help='записать результаты в колоночный файл '
+                             'вместо вывода текста')
+    parser.add_argument('--dedup-window', type=int, default=0,
+                        help='отбрасывать повторы среди последних N '
+                             'пакетов с полем device, 0 - без проверки')
+    parser.add_argument('--dedup-error-rate', type=float, default=0.001,
+                        help='доля ложных срабатываний проверки повторов')
+    parser.add_argument('--dedup-file',
+                        help='файл состояния проверки повторов')
+    args = parser.parse_args(argv)
+    if args.profile and args.workers != 1:
+        parser.error('--profile (FITNESS_TRACKER_PROFILE) профилирует '
+                     'только обработку в одном процессе, укажите -j 1')
+    if args.startup_profile:
+        _print_startup_profile()
+        return
+    if args.metrics:
+        instrumentation.enable()
+        atexit.register(instrumentation.export, args.metrics)
+    if args.serve or args.load:
+        _run_network(args)
+        return
+    if args.shard or args.worker:
+        _run_sharded(args)
+        return
+    if args.source is None:
+        _print_messages(DEMO_PACKAGES, args)
+        return
+    if args.binary:
+        _print_messages(read_binary(args.source), args)
+        return
+    with open_source(args.source) as source:
+        _print_messages(source, args)
+
+
+def _print_startup_profile() -> None:
+    """Вывести замер запуска и сравнить его с бюджетом."""
+    profile = startup_profile()
+    print(f'Запуск: {profile["wall_seconds"]:.3f} с '
+          f'(бюджет {STARTUP_BUDGET_SECONDS:.3f} с), '
+          f'импорт модуля: {profile["import_us"] / 1000:.1f} мс')
+    for cumulative, name in profile['top']:
+        print(f'{cumulative / 1000:10.1f} мс  {name}')
+
+
+def _run_sharded(args: argparse.Namespace) -> None:
+    """Запустить координатор или обработчик частей."""
+    if args.worker:
+        run_worker(args.worker)
+        return
+    source = DEMO_PACKAGES
+    if args.source is not None and args.binary:
+        source = read_binary(args.source)
+    elif args.source is not None:
+        source = open_source(args.source)
+    coordinate(source, args.shard, workers=args.workers or None,
+               shard_size=args.shard_size)
+    write_lines(iter_shard_output(args.shard))
+
+
+def _run_network(args: argparse.Namespace) -> None:
+    """Запустить сервер или нагрузочный клиент."""
+    host, _, port = (args.serve or args.load).rpartition(':')
+    if args.serve:
+        cache = ResultCache(args.cache_size) if args.cache_size else None
+        try:
+            asyncio.run(serve(host, int(port), cache=cache))
+        except KeyboardInterrupt:
+            pass
+        return
+    stats = asyncio.run(run_load(host, int(port),
+                                 connections=args.connections))
+    print(json.dumps(stats.summary()))
+
+
+def _print_messages(source: Iterable, args: argparse.Namespace) -> None:
+    """Вывести сообщения, обработав пакеты в одном или нескольких процессах."""
+    cache_options = None
+    if args.cache_size or args.cache_file:
+        cache_options = {'maxsize': args.cache_size, 'ttl': args.cache_ttl,
+                         'path': args.cache_file}
+    as_text = args.columnar is None
+    chunk_lines = 1 if source is sys.stdin else 4096
+    dedup = None
+    errors: ErrorHandler = report_error
+    on_flush = None
+    if args.dedup_window:
+        dedup = PacketDeduplicator(args.dedup_window, args.dedup_error_rate,
+                                   args.dedup_file)
+        source, errors, on_flush = _checkpoint_hooks(
+            dedup, dedup.filter(source),
+            None if args.workers == 1 else args.chunk_size)
+    if args.workers == 1:
+        cache = ResultCache(**cache_options) if cache_options else None
+        messages = process_stream(source, cache=cache)
+        if args.profile:
+            messages = profile_stream(messages, args.profile,
+                                      args.profile_output)
+    else:
+        messages = process_parallel(source, errors, as_text=as_text,
+                                    workers=args.workers or None,
+                                    chunk_size=args.chunk_size,
+                                    cache_options=cache_options)
+    try:
+        _write_messages(messages, args, chunk_lines, on_flush)
+    finally:
+        if dedup is not None:
+            print(f'Отброшено повторов: {dedup.dropped}', file=sys.stderr)
+    if dedup is not None:
+        dedup.checkpoint(force=True)
+
+
+def _checkpoint_hooks(dedup: PacketDeduplicator,
+                      packages: Iterable[Package],
+                      chunk_size: Optional[int]
+                      ) -> Tuple[Iterable[Package], ErrorHandler,
+                                 Callable[[int], None]]:
+    """Связать контрольные точки фильтра повторов с записью вывода.
+
+    Возвращает источник, обработчик ошибок и `on_flush` для вывода. При
+    последовательной обработке (`chunk_size=None`) после записи блока
+    выведены результаты всех пропущенных пакетов. При параллельной пакеты
+    читаются частями заранее, поэтому сохраняется состояние на границе
+    части, каждый пакет которой уже выведен или передан в ошибки.
+    """
+    if chunk_size is None:
+        def on_flush(count: int) -> None:
+            dedup.checkpoint()
+
+        return packages, report_error, on_flush
+    failed = 0
+
+    def errors(package: object, error: Exception) -> None:
+        nonlocal failed
+        failed += 1
+        report_error(package, error)
+
+    def on_chunk_flush(count: int) -> None:
+        dedup.checkpoint(count + failed)
+
+    return dedup.mark_chunks(packages, chunk_size), errors, on_chunk_flush
+
+
+def _write_messages(messages: Iterable,
+                    args: argparse.Namespace,
+                    chunk_lines: int,
+                    on_flush: Optional[Callable[[int], None]] = None
+                    ) -> None:
+    """Записать результаты в колоночный файл или вывести текстом.
+
+    Колоночный файл дописывается группами строк, поэтому `on_flush` для
+    него не вызывается.
+    """
+    if args.columnar is not None:
+        with ColumnarWriter(args.columnar) as writer:
+            writer.write_all(messages)
+    elif args.workers == 1:
+        render_messages(messages, chunk_lines=chunk_lines,
+                        on_flush=on_flush)
+    else:
+        write_lines(messages, chunk_lines=chunk_lines, on_flush=on_flush)
+
+
 if __name__ == '__main__':
-    packages = [
-        ('SWM', [720, 1, 80, 25, 40]),
-        ('RUN', [15000, 1, 75]),
-        ('WLK', [9000, 1, 75, 180]),
-    ]
-
-    for workout_type, data in packages:
-        training = read_package(workout_type, data)
-        main(training)
+    cli()
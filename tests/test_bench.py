@@ -0,0 +1,29 @@
+import json
+
+import bench
+
+
+def test_run():
+    result = bench.run(300, seed=1)
+    assert result['size'] == 300
+    for name in ('read_package', 'show_training_info', 'get_message',
+                 'compute_batch', 'Running.get_spent_calories',
+                 'SportsWalking.get_spent_calories',
+                 'Swimming.get_spent_calories'):
+        assert result['ns_per_packet'][name] > 0, (
+            f'Замер `{name}` должен присутствовать в результате.'
+        )
+
+
+def test_cli_baseline(tmp_path):
+    output = tmp_path / 'bench.json'
+    assert bench.cli(['--size', '100', '--output', str(output)]) == 0
+    baseline = json.loads(output.read_text(encoding='utf-8'))
+    baseline['ns_per_packet'] = {
+        name: value / 100 for name, value in baseline['ns_per_packet'].items()
+    }
+    slow = tmp_path / 'slow.json'
+    slow.write_text(json.dumps(baseline), encoding='utf-8')
+    assert bench.cli(['--size', '100', '--baseline', str(slow)]) == 1, (
+        'Замедление относительно baseline должно давать код возврата 1.'
+    )
@@ -2,6 +2,7 @@ import re
 import pytest
 import types
 import inspect
+from io import StringIO
 from conftest import Capturing
 
 try:
@@ -363,3 +364,1067 @@ def test_main_output(input_data, expected):
     assert get_message_output == expected, (
         'Метод `main` должен печатать результат в консоль.\n'
     )
+
+
+@pytest.mark.parametrize('packages', [
+    [('SWM', [720, 1, 80, 25, 40]),
+     ('RUN', [15000, 1, 75]),
+     ('WLK', [9000, 1, 75, 180])],
+    [('RUN', [1206, 12, 6]),
+     ('WLK', [420, 4, 20, 42]),
+     ('SWM', [420, 4, 20, 42, 4]),
+     ('WLK', [1206, 12, 6, 12]),
+     ('RUN', [420, 4, 20])],
+])
+def test_compute_batch(packages):
+    workout_types = [workout_type for workout_type, _ in packages]
+    columns = [[data[j] if j < len(data) else 0 for _, data in packages]
+               for j in range(5)]
+    result = homework.compute_batch(workout_types, columns)
+    for index, (workout_type, data) in enumerate(packages):
+        expected = homework.read_package(workout_type, data)
+        info = expected.show_training_info()
+        for field in ('duration', 'distance', 'speed', 'calories'):
+            assert float(result[field][index]) == getattr(info, field), (
+                'Функция `compute_batch` должна совпадать с расчётом '
+                f'через объекты тренировок в поле `{field}`.'
+            )
+        assert result['training_type'][index] == info.training_type
+
+
+def test_compute_batch_random():
+    rng = homework.np.random.default_rng(0)
+    size = 20000
+    workout_types = rng.choice(['WLK', 'SWM'], size)
+    columns = [rng.integers(1, 30000, size).astype(float),
+               rng.uniform(0.1, 3, size),
+               rng.uniform(40, 120, size),
+               rng.choice([25, 50, 33, 120, 140, 175.5, 209, 300], size),
+               rng.choice([0, 10, 40, 999, 1001, 2.5], size)]
+    result = homework.compute_batch(workout_types, columns)
+    expected = [
+        homework.read_package(workout_type, [
+            column[index] for column in columns[:5 if workout_type == 'SWM'
+                                                else 4]
+        ]).get_spent_calories()
+        for index, workout_type in enumerate(workout_types.tolist())
+    ]
+    assert result['calories'].tolist() == expected, (
+        'Пакетный расчёт должен побитно совпадать с расчётом по объектам.'
+    )
+
+
+def test_compute_batch_walking_near_boundary():
+    np = homework.np
+    heights = np.repeat(np.arange(140.0, 210.0), 40)
+    multiples = np.tile(np.arange(1.0, 41.0), 70)
+    duration = 6.5 / np.sqrt(multiples * heights)
+    durations = np.concatenate([np.nextafter(duration, 0), duration,
+                                np.nextafter(duration, np.inf)])
+    size = len(durations)
+    columns = [np.full(size, 10000.0), durations, np.full(size, 75.0),
+               np.tile(heights, 3)]
+    result = homework.compute_batch(['WLK'] * size, columns)
+    expected = [
+        homework.SportsWalking(*row).get_spent_calories()
+        for row in zip(*(column.tolist() for column in columns))
+    ]
+    assert result['calories'].tolist() == expected, (
+        'Квадрат скорости у кратного росту должен делиться так же, '
+        'как в `SportsWalking.get_spent_calories`.'
+    )
+
+
+def test_compute_batch_unknown_type():
+    with pytest.raises(ValueError):
+        homework.compute_batch(['XXX'], [[1], [1], [1]])
+
+
+def test_compute_batch_overridden_formula(monkeypatch):
+    monkeypatch.setattr(homework, 'TRAINING_TYPES',
+                        dict(homework.TRAINING_TYPES))
+
+    @homework.register_training('HVY')
+    class Heavy(homework.Running):
+        def get_spent_calories(self):
+            return super().get_spent_calories() * 2
+
+    @homework.register_training('LNG')
+    class Long(homework.Running):
+        LEN_STEP = 1.0
+
+    assert not homework.has_batch_formulas(Heavy)
+    assert homework.has_batch_formulas(Long)
+    packages = [('HVY', [15000, 1, 75]), ('LNG', [15000, 1, 75]),
+                ('RUN', [15000, 1, 75])]
+    workout_types = [workout_type for workout_type, _ in packages]
+    columns = [[data[j] for _, data in packages] for j in range(3)]
+    result = homework.compute_batch(workout_types, columns)
+    assert result['calories'].tolist() == [
+        homework.read_package(*package).get_spent_calories()
+        for package in packages
+    ], (
+        'Переопределённая формула должна учитываться в `compute_batch`.'
+    )
+
+
+def test_process_stream():
+    source = iter([
+        'RUN,1206,12,6\n',
+        '\n',
+        '["SWM", [720, 1, 80, 25, 40]]\n',
+        'XXX,1,2,3\n',
+        'WLK,9000,0,75,180\n',
+        'RUN,abc\n',
+        '{"type": "WLK", "data": [9000, 1, 75, 180]}\n',
+    ])
+    errors = []
+    result = list(homework.process_stream(
+        source, errors=lambda package, error: errors.append(package),
+        as_text=True,
+    ))
+    assert result == [
+        'Тип тренировки: Running; '
+        'Длительность: 12.000 ч.; '
+        'Дистанция: 0.784 км; '
+        'Ср. скорость: 0.065 км/ч; '
+        'Потрачено ккал: -81.320.',
+        'Тип тренировки: Swimming; '
+        'Длительность: 1.000 ч.; '
+        'Дистанция: 0.994 км; '
+        'Ср. скорость: 1.000 км/ч; '
+        'Потрачено ккал: 336.000.',
+        'Тип тренировки: SportsWalking; '
+        'Длительность: 1.000 ч.; '
+        'Дистанция: 5.850 км; '
+        'Ср. скорость: 5.850 км/ч; '
+        'Потрачено ккал: 157.500.',
+    ], (
+        'Функция `process_stream` должна обрабатывать CSV и JSON пакеты.'
+    )
+    assert len(errors) == 3, (
+        'Некорректные пакеты должны передаваться в обработчик ошибок.'
+    )
+
+
+def test_process_parallel():
+    packages = [homework.DEMO_PACKAGES[index % 3] for index in range(50)]
+    packages.insert(7, ('XXX', [1, 2, 3]))
+    errors = []
+    result = list(homework.process_parallel(
+        packages, errors=lambda package, error: errors.append(package),
+        as_text=True, workers=2, chunk_size=4,
+    ))
+    expected = list(homework.process_stream(
+        packages, errors=lambda package, error: None, as_text=True,
+    ))
+    assert result == expected, (
+        'Функция `process_parallel` должна сохранять порядок пакетов.'
+    )
+    assert errors == [('XXX', [1, 2, 3])]
+
+
+def test_InfoMessage_slots():
+    info = homework.InfoMessage('Running', 1, 2, 3, 4)
+    assert not hasattr(info, '__dict__'), (
+        'Класс `InfoMessage` должен хранить поля в `__slots__`.'
+    )
+
+
+@pytest.mark.parametrize('workout_type, data', homework.DEMO_PACKAGES)
+def test_slotted_training(workout_type, data):
+    training_class = homework.TRAINING_TYPES[workout_type]
+    slotted_class = homework.slotted_training(training_class)
+    assert homework.slotted_training(training_class) is slotted_class
+    training = slotted_class(*data)
+    assert not hasattr(training, '__dict__'), (
+        'Компактный вариант тренировки должен хранить поля в `__slots__`.'
+    )
+    assert training.show_training_info() == (
+        training_class(*data).show_training_info())
+    with pytest.raises(TypeError):
+        slotted_class(*data[:-1])
+
+
+def test_InfoMessageBatch():
+    messages = [homework.read_package(*package).show_training_info()
+                for package in homework.DEMO_PACKAGES * 2]
+    batch = homework.InfoMessageBatch.from_messages(messages)
+    assert len(batch) == len(messages)
+    assert batch.type_codes.dtype.itemsize == 1
+    assert list(batch) == messages, (
+        '`InfoMessageBatch` должен восстанавливать исходные сообщения.'
+    )
+    assert batch[4] == messages[4]
+    assert list(batch.get_messages()) == [
+        info.get_message() for info in messages
+    ]
+
+
+def test_render_messages():
+    messages = [homework.read_package(*package).show_training_info()
+                for package in homework.DEMO_PACKAGES * 3]
+    stream = StringIO()
+    count = homework.render_messages(messages, stream, chunk_lines=2)
+    expected = ''.join(info.get_message() + '\n' for info in messages)
+    assert count == len(messages)
+    assert stream.getvalue() == expected, (
+        'Функция `render_messages` должна выводить те же строки, '
+        'что и `print(info.get_message())`.'
+    )
+    with Capturing() as output:
+        homework.write_lines(['a', 'b', 'c'], chunk_lines=2)
+    assert output == ['a', 'b', 'c']
+
+
+def test_write_lines_streaming():
+    stream = StringIO()
+    written = []
+
+    def lines():
+        for line in ('a', 'b'):
+            yield line
+            written.append(stream.getvalue())
+
+    homework.write_lines(lines(), stream, chunk_lines=1)
+    assert written == ['a\n', 'a\nb\n'], (
+        'При `chunk_lines=1` строка должна выводиться сразу.'
+    )
+
+
+def test_Training_formula_counts():
+    instrumentation = homework.Instrumentation()
+    running = homework.Running(9000, 1, 75)
+    instrumentation.enable()
+    try:
+        info = running.show_training_info()
+    finally:
+        instrumentation.disable()
+    counts = {name: value['count']
+              for name, value in instrumentation.to_dict().items()}
+    assert counts == {
+        'Training.get_distance': 3, 'Training.get_mean_speed': 2,
+        'Running.get_spent_calories': 1, 'show_training_info': 1,
+    }, (
+        'Счётчики должны показывать число расчётов каждой формулы.'
+    )
+    assert (info.distance, info.speed, info.calories) == (
+        running.get_distance(), running.get_mean_speed(),
+        running.get_spent_calories())
+    running.duration = 2
+    assert running.duration_min == 120
+    assert running.get_mean_speed() == 2.925, (
+        'Показатели должны учитывать изменение `duration`.'
+    )
+
+
+def test_Training_super_overrides():
+    class Fast(homework.Running):
+        def get_mean_speed(self):
+            return super().get_mean_speed() * 1.1
+
+    class Heavy(homework.Running):
+        def get_spent_calories(self):
+            return super().get_spent_calories() * 2
+
+    running = homework.Running(9000, 1, 75)
+    fast = Fast(9000, 1, 75).show_training_info()
+    assert fast.speed == running.get_mean_speed() * 1.1
+    heavy = Heavy(9000, 1, 75)
+    assert heavy.get_spent_calories() == running.get_spent_calories() * 2
+    assert heavy.show_training_info().calories == (
+        running.get_spent_calories() * 2), (
+        'Переопределение формул через `super()` должно работать.'
+    )
+    patched = homework.Running(9000, 1, 75)
+    patched.get_spent_calories = lambda: 100
+    assert patched.show_training_info().calories == 100
+
+
+def test_ResultCache():
+    cache = homework.ResultCache(maxsize=2)
+    first = cache.get('RUN', [9000, 1, 75])
+    assert cache.get('RUN', (9000, 1, 75)) is first
+    cache.get('SWM', [720, 1, 80, 25, 40])
+    cache.get('RUN', [9000, 1, 75])
+    cache.get('WLK', [9000, 1, 75, 180])
+    assert cache.stats() == {'hits': 2, 'misses': 3, 'size': 2}, (
+        'Кэш должен учитывать попадания и промахи.'
+    )
+    cache.get('RUN', [9000, 1, 75])
+    assert cache.hits == 3, 'LRU должен сохранить недавно прочитанный пакет.'
+    cache.get('SWM', [720, 1, 80, 25, 40])
+    assert cache.misses == 4, 'LRU должен вытеснить самый старый пакет.'
+    with pytest.raises(ValueError):
+        cache.get('XXX', [1, 2, 3])
+    with pytest.raises(ValueError):
+        homework.ResultCache(policy='random')
+
+
+def test_ResultCache_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(homework.time, 'time', lambda: now[0])
+    cache = homework.ResultCache(ttl=10)
+    cache.get('RUN', [9000, 1, 75])
+    now[0] += 5
+    cache.get('RUN', [9000, 1, 75])
+    now[0] += 20
+    cache.get('RUN', [9000, 1, 75])
+    assert (cache.hits, cache.misses) == (1, 2), (
+        'Запись кэша должна устаревать через `ttl` секунд.'
+    )
+
+
+def test_ResultCache_shared_file(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    writer = homework.ResultCache(path=path)
+    expected = writer.get('WLK', [9000, 1, 75, 180])
+    writer.close()
+    reader = homework.ResultCache(path=path)
+    assert reader.get('WLK', [9000, 1, 75, 180]) == expected
+    assert reader.stats()['misses'] == 0, (
+        'Результат должен читаться из общего файла кэша.'
+    )
+    reader.close()
+
+
+def test_ResultCache_shared_file_bounded(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(homework.time, 'time', lambda: now[0])
+    monkeypatch.setattr(homework.ResultCache, 'PRUNE_INTERVAL', 1)
+    path = str(tmp_path / 'cache.db')
+    cache = homework.ResultCache(ttl=100, path=path, store_size=2)
+    for action in range(1000, 1005):
+        now[0] += 1
+        cache.get('RUN', [action, 1, 75])
+    rows = cache._store.execute(
+        'SELECT created FROM results ORDER BY created').fetchall()
+    assert rows == [(1004.0,), (1005.0,)], (
+        'В общем файле должны оставаться только новые записи.'
+    )
+    now[0] += 200
+    cache.prune()
+    assert cache._store.execute(
+        'SELECT COUNT(*) FROM results').fetchone() == (0,), (
+        'Устаревшие записи должны удаляться из общего файла.'
+    )
+    cache.close()
+
+
+def test_binary_roundtrip(tmp_path):
+    path = str(tmp_path / 'packages.bin')
+    packages = homework.DEMO_PACKAGES + [('RUN', [1206, 12, 6]),
+                                         ('WLK', [420, 4, 20, 42])]
+    assert homework.write_binary(path, packages) == len(packages)
+    assert list(homework.read_binary(path)) == packages, (
+        'Бинарный архив должен возвращать исходные пакеты.'
+    )
+    workout_types, columns = homework.read_binary_columns(path)
+    result = homework.compute_batch(workout_types, columns)
+    expected = [homework.read_package(*package).show_training_info()
+                for package in packages]
+    assert result['calories'].tolist() == [
+        info.calories for info in expected
+    ]
+    assert result['training_type'] == [
+        info.training_type for info in expected
+    ]
+
+
+def test_binary_wrong_file(tmp_path):
+    path = tmp_path / 'packages.csv'
+    path.write_text('RUN,9000,1,75\n', encoding='utf-8')
+    with pytest.raises(ValueError):
+        list(homework.read_binary(str(path)))
+
+
+@pytest.mark.parametrize('package', [
+    ('RUNNING', [1, 1, 1]),
+    ('RU', [1, 1, 1]),
+    ('RUN', [15000.5, 1, 75]),
+    ('RUN', [-1, 1, 75]),
+])
+def test_binary_rejects_lossy_packages(tmp_path, package):
+    with pytest.raises(ValueError):
+        homework.write_binary(str(tmp_path / 'packages.bin'), [package])
+
+
+def test_binary_whole_float_action(tmp_path):
+    path = str(tmp_path / 'packages.bin')
+    homework.write_binary(path, [('RUN', [15000.0, 1, 75])])
+    assert list(homework.read_binary(path)) == [('RUN', [15000, 1, 75])]
+
+
+def test_PacketServer():
+    async def scenario():
+        packet_server = homework.PacketServer(batch_size=4, queue_size=2)
+        server = await packet_server.start()
+        host, port = server.sockets[0].getsockname()[:2]
+        async with server:
+            reader, writer = await homework.asyncio.open_connection(
+                host, port)
+            writer.write(b'["RUN", [1206, 12, 6]]\n{"type": "XXX"}\n')
+            await writer.drain()
+            responses = [await reader.readline() for _ in range(2)]
+            writer.close()
+            stats = await homework.run_load(host, port, connections=3,
+                                            repeat=5)
+        return packet_server, responses, stats
+
+    packet_server, responses, stats = homework.asyncio.run(scenario())
+    assert homework.json.loads(responses[0]) == {
+        'message': 'Тип тренировки: Running; '
+                   'Длительность: 12.000 ч.; '
+                   'Дистанция: 0.784 км; '
+                   'Ср. скорость: 0.065 км/ч; '
+                   'Потрачено ккал: -81.320.'
+    }
+    assert 'error' in homework.json.loads(responses[1]), (
+        'Сервер должен отвечать ошибкой на некорректный пакет.'
+    )
+    assert stats.count == 3 * 5 * len(homework.DEMO_PACKAGES)
+    assert packet_server.latency.count > 0
+    summary = stats.summary()
+    assert 0 <= summary['p50_ms'] <= summary['p99_ms']
+
+
+@pytest.mark.parametrize('line, error', [
+    (b'["RUN", [1, 0, 75]]\n', 'Running: поле duration должно быть больше '
+                                'нуля'),
+    (b'RUN,15000,1\n', 'Running: ожидается 3 полей, получено 2'),
+])
+def test_PacketServer_answer_validates(line, error):
+    answer = homework.PacketServer().answer(line)
+    assert homework.json.loads(answer) == {'error': error}, (
+        'Сервер должен отвечать сообщением `check_package`.'
+    )
+
+
+def test_PacketServer_broken_connection():
+    class BrokenWriter:
+        def write(self, data):
+            pass
+
+        async def drain(self):
+            raise ConnectionResetError
+
+        def close(self):
+            pass
+
+    async def scenario():
+        packet_server = homework.PacketServer(batch_size=1, queue_size=2)
+        reader = homework.asyncio.StreamReader()
+        reader.feed_data(b'RUN,9000,1,75\n' * 10)
+        await homework.asyncio.wait_for(
+            packet_server._handle(reader, BrokenWriter()), timeout=5)
+        return packet_server
+
+    assert homework.asyncio.run(scenario()).connections == 0, (
+        'Обработчик соединения должен завершаться при обрыве отправки.'
+    )
+
+
+def test_Aggregator(tmp_path):
+    packages = [('RUN', [9000, 1, 75]), ('RUN', [15000, 2, 75]),
+                ('WLK', [9000, 1, 75, 180]), ('RUN', [1206, 12, 6])]
+    infos = [homework.read_package(*package).show_training_info()
+             for package in packages]
+    whole = homework.Aggregator()
+    left, right = homework.Aggregator(), homework.Aggregator()
+    for index, info in enumerate(infos):
+        whole.add('user', info)
+        (left if index % 2 else right).add('user', info)
+    left.merge(right)
+    running = whole.get('user', 'Running')
+    assert left.get('user', 'Running').to_list() == pytest.approx(
+        running.to_list()
+    ), (
+        'Объединение частичных итогов должно давать полный итог.'
+    )
+    assert running.count == 3
+    assert running.distance == sum(info.distance for info in infos
+                                   if info.training_type == 'Running')
+    assert running.mean_speed == pytest.approx(
+        (5.85 * 1 + 4.875 * 2 + 0.065325 * 12) / 15
+    )
+    assert running.max_calories == infos[1].calories
+    assert running.min_speed == infos[3].speed
+    path = str(tmp_path / 'checkpoint.json')
+    whole.save(path)
+    restored = homework.Aggregator.load(path)
+    assert restored.get('user', 'SportsWalking').to_list() == (
+        whole.get('user', 'SportsWalking').to_list()
+    ), 'Контрольная точка должна восстанавливать итоги.'
+
+
+def test_register_training(monkeypatch):
+    monkeypatch.setattr(homework, 'TRAINING_TYPES',
+                        dict(homework.TRAINING_TYPES))
+
+    @homework.register_training('ROW')
+    class Rowing(homework.Running):
+        pass
+
+    assert homework.read_package('ROW', [9000, 1, 75]).__class__ is Rowing
+    with pytest.raises(ValueError):
+        homework.register_training('RUN')(Rowing)
+
+
+def test_plugin_loaded_lazily(monkeypatch, tmp_path):
+    from importlib import metadata
+    (tmp_path / 'cycling_plugin.py').write_text(
+        'import homework\n\n\n'
+        "@homework.register_training('CYC')\n"
+        'class Cycling(homework.Running):\n'
+        '    LEN_STEP = 5.0\n',
+        encoding='utf-8',
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(homework, 'TRAINING_TYPES',
+                        dict(homework.TRAINING_TYPES))
+    monkeypatch.setattr(homework, '_plugins', {
+        'CYC': metadata.EntryPoint('CYC', 'cycling_plugin',
+                                   homework.PLUGIN_GROUP),
+    })
+    assert 'cycling_plugin' not in homework.sys.modules
+    training = homework.read_package('CYC', [1000, 1, 75])
+    assert training.__class__.__name__ == 'Cycling', (
+        'Плагин должен загружаться при первом пакете с его кодом.'
+    )
+    assert training.get_distance() == 5.0
+    monkeypatch.delitem(homework.sys.modules, 'cycling_plugin')
+
+
+@pytest.mark.parametrize('input_data, valid', [
+    (('RUN', [15000, 1, 75]), True),
+    (('SWM', [720, 1.5, 80, 25, 0]), True),
+    (('RUN', [15000, 1]), False),
+    (('RUN', [15000, 0, 75]), False),
+    (('RUN', [-1, 1, 75]), False),
+    (('RUN', [15000, '1', 75]), False),
+    (('RUN', [15000, True, 75]), False),
+    (('RUN', [15000, float('nan'), 75]), False),
+    (('WLK', [9000, 1, 75, 0]), False),
+    (('SWM', [720, 1, 80, 0, 40]), False),
+    (('XXX', [1, 2, 3]), False),
+])
+def test_check_package(input_data, valid):
+    problem = homework.check_package(*input_data)
+    assert (problem is None) == valid, (
+        'Функция `check_package` должна проверять число полей, '
+        'их типы и допустимые значения.'
+    )
+
+
+def test_check_package_numpy_scalars():
+    np = homework.np
+    data_def = [np.int64(15000), np.float64(1), np.int32(75)]
+    assert homework.check_package('RUN', data_def) is None, (
+        'Числа NumPy должны проходить проверку пакета.'
+    )
+    assert homework.check_package('RUN', [15000, np.bool_(True), 75])
+
+
+def test_validate_batch():
+    packages = [('RUN', [15000, 1, 75]), ('RUN', [15000, 0, 75]),
+                ('WLK', [9000, 1, 75, 0]), ('SWM', [720, 1, 80, 25, 40]),
+                ('XXX', [1, 1, 1]), ('WLK', [9000, 1, 75, 180])]
+    workout_types = [workout_type for workout_type, _ in packages]
+    columns = [[data[j] if j < len(data) else 0 for _, data in packages]
+               for j in range(5)]
+    mask = homework.validate_batch(workout_types, columns)
+    assert mask.tolist() == [True, False, False, True, False, True]
+    assert mask.tolist() == [
+        homework.check_package(*package) is None for package in packages
+    ]
+
+
+def test_parse_package_coerces_json_strings():
+    assert homework.parse_package('["RUN", ["15000", "1.5", 75]]') == (
+        'RUN', [15000, 1.5, 75]
+    )
+
+
+def test_Instrumentation(tmp_path):
+    original = homework.read_package
+    instrumentation = homework.Instrumentation()
+    instrumentation.enable()
+    try:
+        list(homework.process_stream(homework.DEMO_PACKAGES, as_text=True))
+    finally:
+        instrumentation.disable()
+    assert homework.read_package is original, (
+        'После `disable` должны возвращаться исходные функции.'
+    )
+    counts = {name: value['count']
+              for name, value in instrumentation.to_dict().items()}
+    assert counts == {
+        'read_package': 3,
+        'show_training_info': 3,
+        'get_message': 3,
+        'Training.get_distance': 6,
+        'Training.get_mean_speed': 4,
+        'Swimming.get_distance': 1,
+        'Swimming.get_mean_speed': 2,
+        'Running.get_spent_calories': 1,
+        'SportsWalking.get_spent_calories': 1,
+        'Swimming.get_spent_calories': 1,
+    }
+    path = str(tmp_path / 'metrics.prom')
+    instrumentation.export(path)
+    with open(path, encoding='utf-8') as file:
+        text = file.read()
+    assert ('fitness_tracker_call_duration_seconds_count'
+            '{operation="read_package"} 3') in text
+
+
+def test_Instrumentation_render_and_workers():
+    instrumentation = homework.instrumentation
+    instrumentation.enable()
+    try:
+        homework.render_messages(
+            homework.process_stream(homework.DEMO_PACKAGES), StringIO())
+        list(homework.process_parallel(homework.DEMO_PACKAGES, as_text=True,
+                                       workers=2, chunk_size=1))
+    finally:
+        instrumentation.disable()
+        counts = {name: value['count']
+                  for name, value in instrumentation.to_dict().items()}
+        instrumentation.reset()
+    assert counts['get_message'] == 6, (
+        'Замер `get_message` должен учитывать `render_messages`.'
+    )
+    assert counts['read_package'] == 6, (
+        'Замеры процессов-исполнителей должны объединяться.'
+    )
+
+
+def test_profile_stream(tmp_path):
+    import pstats
+    path = str(tmp_path / 'stream.prof')
+    results = list(homework.profile_stream(
+        homework.process_stream(homework.DEMO_PACKAGES * 2), 2, path))
+    assert len(results) == 6
+    assert pstats.Stats(path).total_calls > 0
+
+
+def test_columnar_roundtrip(tmp_path):
+    path = str(tmp_path / 'results.col')
+    messages = [homework.read_package(*package).show_training_info()
+                for package in homework.DEMO_PACKAGES * 5]
+    with homework.ColumnarWriter(path, row_group_size=4) as writer:
+        writer.write_all(messages)
+        writer.write_batch(homework.InfoMessageBatch.from_messages(
+            messages[:2]))
+    assert writer.rows_written == len(messages) + 2
+    batches = list(homework.read_columnar(path))
+    assert [len(batch) for batch in batches] == [4, 4, 4, 3, 2], (
+        'Результаты должны записываться группами по `row_group_size`.'
+    )
+    restored = [info for batch in batches for info in batch]
+    assert restored == messages + messages[:2], (
+        'Колоночный файл должен восстанавливать исходные сообщения.'
+    )
+
+
+def test_columnar_empty(tmp_path):
+    path = str(tmp_path / 'empty.col')
+    homework.ColumnarWriter(path).close()
+    assert list(homework.read_columnar(path)) == []
+
+
+def test_SampleSeries(tmp_path):
+    values = [0, 3, 2, 2, 400, -5, 1000000, 7, 7, 1]
+    series = homework.SampleSeries(chunk_size=4)
+    series.extend(values)
+    assert len(series) == len(values)
+    assert len(series.chunks) == 2
+    assert list(series.iter_range()) == values
+    for start, stop in [(0, 4), (2, 9), (5, 6), (8, 100), (9, 3)]:
+        assert list(series.iter_range(start, stop)) == values[start:stop], (
+            'Выборка диапазона должна совпадать со срезом отсчётов.'
+        )
+    path = str(tmp_path / 'series.bin')
+    series.save(path)
+    restored = homework.SampleSeries.load(path)
+    restored.extend([5, 6])
+    assert list(restored.iter_range()) == values + [5, 6]
+
+
+def test_Training_from_series():
+    steps = homework.SampleSeries()
+    steps.extend([2, 3] * 1800)
+    running = homework.Running.from_series(steps, 75)
+    assert running.get_spent_calories() == homework.Running(
+        9000, 1, 75).get_spent_calories()
+    walking = homework.SportsWalking.from_series(steps, 75, 180,
+                                                 start=0, stop=1800)
+    assert (walking.action, walking.duration) == (4500, 0.5)
+    laps = homework.SampleSeries()
+    strokes = homework.SampleSeries()
+    for second in range(3600):
+        laps.append(1 if second % 90 == 0 else 0)
+        strokes.append(1 if second % 5 == 0 else 0)
+    swimming = homework.Swimming.from_series(laps, 80, 25, strokes)
+    assert (swimming.action, swimming.count_pool) == (720, 40)
+    assert swimming.get_spent_calories() == 336.0
+
+
+def test_import_is_lightweight():
+    import subprocess
+    code = ('import sys, homework; print(sorted(m for m in ('
+            '"numpy", "asyncio", "sqlite3", "concurrent.futures", '
+            '"cProfile", "argparse") if m in sys.modules))')
+    completed = subprocess.run(
+        [homework.sys.executable, '-c', code],
+        cwd=homework.os.path.dirname(homework.__file__),
+        capture_output=True, text=True, check=True,
+    )
+    assert completed.stdout.strip() == '[]', (
+        'Тяжёлые модули должны импортироваться только при использовании.'
+    )
+
+
+def test_cold_start_budget():
+    import subprocess
+    import time
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [homework.sys.executable, homework.__file__, '-'],
+        input='RUN,15000,1,75\n', capture_output=True, text=True, check=True,
+    )
+    elapsed = time.perf_counter() - start
+    assert completed.stdout.startswith('Тип тренировки: Running;')
+    assert elapsed < homework.STARTUP_BUDGET_SECONDS, (
+        f'Обработка одного пакета заняла {elapsed:.3f} с, бюджет '
+        f'{homework.STARTUP_BUDGET_SECONDS} с.'
+    )
+    profile = homework.startup_profile(limit=3)
+    assert profile['import_us'] > 0
+    assert len(profile['top']) == 3
+
+
+def test_coordinate(tmp_path):
+    packages = [homework.DEMO_PACKAGES[index % 3] for index in range(10)]
+    packages.insert(4, ('XXX', [1, 2, 3]))
+    workdir = str(tmp_path / 'work')
+    aggregator = homework.coordinate(packages, workdir, workers=2,
+                                     shard_size=3, poll_interval=0.01)
+    expected = list(homework.process_stream(
+        packages, errors=lambda package, error: None, as_text=True))
+    assert list(homework.iter_shard_output(workdir)) == expected, (
+        'Вывод частей должен совпадать с последовательной обработкой.'
+    )
+    running = aggregator.get(homework.ALL_USERS, 'Running')
+    assert running.count == 3
+    assert homework.coordinate(packages, workdir, workers=0).get(
+        homework.ALL_USERS, 'Running').count == 3, (
+        'Повторный запуск должен использовать уже обработанные части.'
+    )
+
+
+def test_worker_recovery(tmp_path):
+    workdir = str(tmp_path / 'work')
+    assert homework.split_archive(homework.DEMO_PACKAGES, workdir, 1) == 3
+    claimed = homework._claim_shard(workdir, 'crashed')
+    assert claimed == ('shard-00000', homework._shard_path(
+        workdir, 'running', 'shard-00000.crashed'))
+    assert homework.recover_stale(workdir, timeout=60) == 0
+    homework.os.utime(claimed[1], (0, 0))
+    assert homework.recover_stale(workdir, timeout=60) == 1, (
+        'Зависшая часть должна возвращаться в очередь.'
+    )
+    assert homework.run_worker(workdir, 'local') == 3
+    assert homework.collect(workdir).get(
+        homework.ALL_USERS, 'Swimming').count == 1
+    homework.split_archive(homework.DEMO_PACKAGES, workdir, 1)
+    assert homework.run_worker(workdir, 'local') == 0
+
+
+def test_worker_recover_dead(tmp_path):
+    import subprocess
+    workdir = str(tmp_path / 'work')
+    homework.split_archive(homework.DEMO_PACKAGES, workdir, 1)
+    finished = subprocess.Popen([homework.sys.executable, '-c', 'pass'])
+    finished.wait()
+    homework._claim_shard(workdir, homework._local_worker_id(finished.pid))
+    homework._claim_shard(workdir, homework._local_worker_id(
+        homework.os.getpid()))
+    homework._claim_shard(workdir, f'elsewhere-{finished.pid}')
+    assert homework.recover_dead(workdir) == 1, (
+        'Часть завершившегося локального процесса должна сразу '
+        'возвращаться в очередь.'
+    )
+    assert homework.os.listdir(homework.os.path.join(workdir, 'pending')) == [
+        'shard-00000.jsonl']
+
+
+def test_process_shard_temporary_names(tmp_path, monkeypatch):
+    workdir = str(tmp_path / 'work')
+    homework.split_archive(homework.DEMO_PACKAGES, workdir, 3)
+    shard, running = homework._claim_shard(workdir, 'first')
+    replaced = []
+    replace = homework.os.replace
+
+    def record(source, target):
+        replaced.append(homework.os.path.basename(source))
+        replace(source, target)
+
+    monkeypatch.setattr(homework.os, 'replace', record)
+    homework._process_shard(workdir, shard, running, 'first')
+    assert replaced == ['shard-00000.out.first.tmp',
+                        'shard-00000.agg.json.first.tmp',
+                        'shard-00000.json.first.tmp'], (
+        'Временные файлы части должны содержать идентификатор обработчика.'
+    )
+
+
+def test_worker_max_attempts(tmp_path, monkeypatch):
+    workdir = str(tmp_path / 'work')
+    homework.split_archive(homework.DEMO_PACKAGES[:1], workdir, 1)
+
+    def broken(*args):
+        raise OSError('диск недоступен')
+
+    monkeypatch.setattr(homework, '_process_shard', broken)
+    assert homework.run_worker(workdir, 'local', max_attempts=2) == 0
+    assert homework.os.listdir(
+        homework.os.path.join(workdir, 'failed')) == ['shard-00000.jsonl'], (
+        'Часть должна переходить в failed после исчерпания попыток.'
+    )
+
+
+def test_output_writer_threads():
+    import threading
+    stream = StringIO()
+    writer = homework.OutputWriter(stream, maxsize=4, buffer_lines=16)
+
+    def produce(training_type):
+        for i in range(200):
+            writer.put(homework.InfoMessage(training_type, i, 0, 0, 0))
+
+    producers = [threading.Thread(target=produce, args=(name,))
+                 for name in ('A', 'B', 'C')]
+    for producer in producers:
+        producer.start()
+    for producer in producers:
+        producer.join()
+    writer.close()
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == writer.written == 600
+    for name in ('A', 'B', 'C'):
+        own = [line for line in lines if line.startswith(
+            f'Тип тренировки: {name};')]
+        assert own == [homework.InfoMessage(name, i, 0, 0, 0).get_message()
+                       for i in range(200)], (
+            'Порядок сообщений одного производителя должен сохраняться.'
+        )
+
+
+def test_output_writer_ordered():
+    stream = StringIO()
+    infos = [homework.InfoMessage('Running', i, 0, 0, 0) for i in range(6)]
+    with homework.OutputWriter(stream, ordered=True) as writer:
+        writer.put_batch(infos[3:], 3)
+        writer.put(infos[1], 1)
+        writer.put_batch(infos[:1], 0)
+        writer.put(infos[2], 2)
+        with pytest.raises(ValueError):
+            writer.put(infos[0])
+    assert stream.getvalue().splitlines() == [
+        info.get_message() for info in infos]
+
+
+def test_output_writer_failure():
+    import threading
+
+    class BrokenStream:
+        def write(self, text):
+            raise OSError('диск заполнен')
+
+        def flush(self):
+            pass
+
+    writer = homework.OutputWriter(BrokenStream(), maxsize=1, buffer_lines=1)
+    raised = []
+
+    def produce():
+        info = homework.InfoMessage('Running', 1, 0, 0, 0)
+        try:
+            for _ in range(100):
+                writer.put(info)
+        except OSError as error:
+            raised.append(error)
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    producer.join(timeout=5)
+    assert not producer.is_alive(), (
+        'Производитель не должен зависать после ошибки потока вывода.'
+    )
+    assert raised
+    with pytest.raises(OSError):
+        writer.close()
+
+
+def test_quantile_sketch_error():
+    import bisect
+    import random
+    rnd = random.Random(1)
+    values = [rnd.lognormvariate(2, 0.5) for _ in range(100000)]
+    first, second = homework.QuantileSketch(), homework.QuantileSketch()
+    for i, value in enumerate(values):
+        (first if i % 2 else second).add(value)
+    first.merge(second)
+    sketch = homework.QuantileSketch.from_bytes(first.to_bytes())
+    assert sketch.count == len(values)
+    assert len(first.to_bytes()) < 10000
+    values.sort()
+    for q in (0.01, 0.5, 0.95, 0.99):
+        rank = bisect.bisect_left(values, sketch.quantile(q)) / len(values)
+        assert abs(rank - q) < 0.02, (
+            f'Ошибка ранга квантиля {q} превышает допустимую.'
+        )
+    assert sketch.quantile(0) == values[0]
+    assert sketch.quantile(1) == values[-1]
+
+
+def test_distinct_counter_error():
+    first, second = homework.DistinctCounter(), homework.DistinctCounter()
+    for i in range(60000):
+        first.add(f'device-{i}')
+        second.add(f'device-{i + 30000}')
+    first.merge(second)
+    counter = homework.DistinctCounter.from_bytes(first.to_bytes())
+    assert abs(counter.count() - 90000) / 90000 < 0.05
+    small = homework.DistinctCounter()
+    for i in range(100):
+        small.add(str(i % 50))
+    assert abs(small.count() - 50) < 3
+    with pytest.raises(ValueError):
+        first.merge(homework.DistinctCounter(10))
+
+
+def test_stream_stats():
+    infos = [homework.InfoMessage('Running', 1, 1, speed, speed * 10)
+             for speed in range(1, 101)]
+    stats = homework.StreamStats()
+    assert list(stats.track(infos[:50])) == infos[:50]
+    other = homework.StreamStats()
+    for number, info in enumerate(infos[50:]):
+        other.add(info, f'device-{number % 7}')
+    stats.merge(other)
+    restored = homework.StreamStats.from_bytes(stats.to_bytes())
+    assert restored.summary() == {'Running': {
+        'speed': [50, 95, 99], 'calories': [500, 950, 990]}}
+    assert round(restored.devices.count()) == 7
+
+
+def test_stream_stats_devices():
+    packages = [
+        '{"type": "RUN", "data": [15000, 1, 75], "device": "tracker-1"}',
+        '{"type": "RUN", "data": [9000, 1, 75], "device": "tracker-2"}',
+        '["WLK", [9000, 1, 75, 180], "tracker-1"]',
+        'SWM,720,1,80,25,40',
+        '{"type": "RUN", "data": [0, 0, 75], "device": "tracker-3"}',
+    ]
+    errors = []
+    stats = homework.StreamStats()
+    infos = list(stats.track(homework.process_device_stream(
+        packages, lambda package, error: errors.append(package))))
+    assert [info.training_type for info in infos] == [
+        'Running', 'Running', 'SportsWalking', 'Swimming']
+    assert len(errors) == 1
+    assert round(stats.devices.count()) == 2, (
+        'Метод `track` должен учитывать устройства из пар `(device, info)`.'
+    )
+
+
+def test_packet_deduplicator(tmp_path):
+    path = str(tmp_path / 'dedup.bin')
+    packages = [(*package, 'tracker-1')
+                for package in homework.DEMO_PACKAGES] * 3
+    dedup = homework.PacketDeduplicator(window=100, path=path)
+    assert list(dedup.filter(packages)) == homework.DEMO_PACKAGES
+    assert dedup.dropped == 6
+    assert list(dedup.filter([
+        '{"type": "RUN", "data": [15000, 1, 75], "device": "tracker-2"}',
+        '["RUN", [15000, 1, 75], "tracker-2"]',
+        'RUN,15000,1,75',
+        'RUN,15000,1,75',
+    ])) == [('RUN', [15000, 1, 75])] * 3, (
+        'Пакеты других устройств и пакеты без устройства '
+        'не должны считаться повторами.'
+    )
+    assert not homework.os.path.exists(path), (
+        'Метод `filter` не должен сам сохранять состояние.'
+    )
+    dedup.checkpoint(force=True)
+    restored = homework.PacketDeduplicator(window=100, path=path)
+    assert restored.dropped == 7
+    assert restored.seen('SWM', [720, 1, 80, 25, 40], 'tracker-1')
+    with pytest.raises(ValueError):
+        homework.PacketDeduplicator(window=200, path=path)
+    with pytest.raises(ValueError):
+        homework.PacketDeduplicator().save()
+
+
+def test_packet_deduplicator_interrupted(tmp_path):
+    path = str(tmp_path / 'dedup.bin')
+    dedup = homework.PacketDeduplicator(window=100, path=path,
+                                        save_interval=0)
+    packages = dedup.filter(('RUN', [action, 1, 75], 'tracker-1')
+                            for action in range(1000, 1010))
+
+    def broken(messages):
+        for number, info in enumerate(messages):
+            if number == 5:
+                raise OSError('диск переполнен')
+            yield info
+
+    with pytest.raises(OSError):
+        homework.render_messages(
+            broken(homework.process_stream(packages)), StringIO(),
+            chunk_lines=2, on_flush=lambda count: dedup.checkpoint())
+    restored = homework.PacketDeduplicator(window=100, path=path)
+    assert not restored.seen('RUN', [1004, 1, 75], 'tracker-1'), (
+        'Состояние не должно включать пакеты, результаты которых '
+        'не записаны.'
+    )
+    assert restored.seen('RUN', [1003, 1, 75], 'tracker-1'), (
+        'Состояние должно сохраняться после каждого записанного блока.'
+    )
+
+
+def test_packet_deduplicator_mark_chunks(tmp_path):
+    path = str(tmp_path / 'dedup.bin')
+    dedup = homework.PacketDeduplicator(window=100, path=path,
+                                        save_interval=0)
+    packages = dedup.mark_chunks(dedup.filter(
+        ('RUN', [action, 1, 75], 'tracker-1')
+        for action in range(1000, 1010)), 4)
+    assert len(list(homework.islice(packages, 8))) == 8
+    dedup.checkpoint(3)
+    assert not homework.os.path.exists(path)
+    dedup.checkpoint(5)
+    restored = homework.PacketDeduplicator(window=100, path=path)
+    assert not restored.seen('RUN', [1004, 1, 75], 'tracker-1'), (
+        'Сохраняться должно состояние на границе полностью '
+        'выведенной части.'
+    )
+    assert restored.seen('RUN', [1003, 1, 75], 'tracker-1')
+    assert len(list(packages)) == 2
+    dedup.checkpoint(10)
+    restored = homework.PacketDeduplicator(window=100, path=path)
+    assert restored.seen('RUN', [1009, 1, 75], 'tracker-1')
+
+
+def test_packet_deduplicator_window():
+    dedup = homework.PacketDeduplicator(window=1000, error_rate=0.01)
+    false_positives = sum(dedup.seen('RUN', [i, 1, 75], 'tracker-1')
+                          for i in range(5000))
+    assert false_positives < 5000 * 0.01
+    assert dedup.seen('RUN', [4500, 1, 75], 'tracker-1')
+    assert not dedup.seen('RUN', [0, 1, 75], 'tracker-1'), (
+        'Пакеты старше окна должны забываться.'
+    )